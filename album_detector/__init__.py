@@ -1,32 +1,123 @@
 import argparse
+import atexit
+import collections
 import os
+import sys
 import json
 
 from album_detector import utils
 from album_detector import file_info
+from album_detector import probe_cache
+from album_detector import indexer
+from album_detector import executor
+from album_detector import checkpoint
+from album_detector import operations
+from album_detector import instrument
+from album_detector import ftype_rules
+from album_detector import hint_store
 
 def album_cb(path):
     cmds = utils.handle_path(path, '/tmp', False)
     return bool(cmds)
 
+def _interrupted(ckpt):
+    if ckpt is not None:
+        ckpt.close()
+        print(f'Progress is kept in {ckpt.fpath}, continue with --resume')
+    return 130
+
+def _report_profile(out, fmt):
+    instrument.print_summary()
+    if out:
+        instrument.dump(out, fmt)
+
 def main():
     parser = argparse.ArgumentParser(description='Normalize album format from different sources for creating music library')
     parser.add_argument('path') 
     parser.add_argument('--output-dir', default='.')
     parser.add_argument('--audio-only', action='store_true')
+    parser.add_argument('--link-mode', choices=operations.LINK_MODES, default='copy',
+            help='How files exported unchanged are put into the library')
+    parser.add_argument('--incremental', action='store_true',
+            help='Skip what an earlier export of the album already did, as recorded in its manifest')
     parser.add_argument('--doit', action='store_true')
     parser.add_argument('--playlist', action='store_true')
     parser.add_argument('--mkindex', action='store_true')
+    parser.add_argument('--index-root', help='Album set to index with --mkindex')
     parser.add_argument('--dump-fail', action='store_true')
     parser.add_argument('--check-fail', action='store_true')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of albums scanned (or export commands run) in parallel')
+    parser.add_argument('--recursive', action='store_true',
+            help='Look for albums at any depth below the album set (--mkindex, --dump-fail)')
+    parser.add_argument('--max-files', type=int, default=utils.max_album_files,
+            help='Largest number of files an album may have')
+    parser.add_argument('--checkpoint', help='Stream scan results to this JSON-lines file (--mkindex, --dump-fail)')
+    parser.add_argument('--resume', action='store_true', help='Skip albums already in the checkpoint')
+    parser.add_argument('--profile', action='store_true', help='Print where the time went')
+    parser.add_argument('--profile-out', help='Also write the recorded timings to this file')
+    parser.add_argument('--profile-format', choices=['json', 'chrome'], default='json',
+            help='json: totals per run and per album, chrome: trace events')
+    parser.add_argument('--rules', help='JSON file of extra file classification rules, tried before the built-in ones')
+    parser.add_argument('--defer-hints', metavar='QUEUE',
+            help='Do not prompt during a scan, queue the hints albums need in this file instead')
+    parser.add_argument('--resolve-hints', action='store_true',
+            help='Ask for the hints queued in path, then process those albums again')
+    parser.add_argument('--hint-db', help='Keep new hints in this JSON file instead of next to the music')
+    parser.add_argument('--cache', help='Persistent probe cache (SQLite file)')
+    parser.add_argument('--cache-size', type=int, default=256, help='Cache size limit in MiB')
+    parser.add_argument('--invalidate-cache', action='store_true', help='Drop cached probes under path')
     args = parser.parse_args()
     path = os.path.normpath(args.path)
 
-    if args.mkindex:
-        input_dir = os.path.normpath('/tmp')
-        indexes = utils.do_scan(input_dir, utils.handle_index)
-        with open(path, 'w') as f:
-            f.write(json.dumps(indexes))
+    if args.profile:
+        instrument.enabled = True
+        atexit.register(_report_profile, args.profile_out, args.profile_format)
+
+    if args.hint_db:
+        hint_store.open_store(args.hint_db)
+
+    utils.max_album_files = args.max_files
+
+    if args.rules:
+        ftype_rules.load_rules(args.rules)
+
+    if args.defer_hints:
+        # Albums queued by --mkindex go to the index once resolved
+        index = os.path.abspath(path) if args.mkindex else None
+        utils.hint_queue = hint_store.open_queue(args.defer_hints, resume=args.resume, index=index)
+        utils.defer_hints = True
+
+    ckpt = None
+    if args.checkpoint:
+        ckpt = checkpoint.open_checkpoint(args.checkpoint, resume=args.resume)
+    else:
+        assert not args.resume, '--resume requires --checkpoint'
+
+    if args.cache:
+        cache = probe_cache.open_cache(args.cache, args.cache_size * 1024 * 1024)
+
+    if args.invalidate_cache:
+        assert args.cache, '--invalidate-cache requires --cache'
+        n_removed = cache.invalidate(os.path.abspath(path))
+        print(f'Invalidated {n_removed} cached probes')
+    elif args.mkindex:
+        assert args.index_root, '--mkindex requires --index-root'
+        indexes = indexer.load_index(path)
+        indexes = indexer.update_index(args.index_root, indexes, jobs=args.jobs,
+                checkpoint=ckpt, recursive=args.recursive)
+        if indexes is None:
+            return _interrupted(ckpt)
+        indexer.write_index(path, indexes)
+    elif args.resolve_hints:
+        entries = collections.defaultdict(dict) # index path: {album: info}
+        def index_cb(album, index_path):
+            entries[index_path][album] = utils.handle_index(album)
+            return entries[index_path][album]
+        results = utils.resolve_hints(path, album_cb, index_cb)
+        for index_path, new_entries in entries.items():
+            indexer.add_entries(index_path, new_entries)
+        n_failed = len([album for album in results if not results[album]])
+        print(f'{len(results) - n_failed} of {len(results)} albums processed, {n_failed} left in {path}')
     elif args.check_fail:
         with open(args.path, 'r') as f:
             path_list = json.loads(f.read())
@@ -35,7 +126,10 @@ def main():
                 album_cb(path)
     elif args.dump_fail:
         utils.no_interact = True
-        dump = utils.do_scan(path, album_cb, include_failed=True)
+        dump = utils.do_scan(path, album_cb, include_failed=True, jobs=args.jobs,
+                checkpoint=ckpt, recursive=args.recursive)
+        if dump is None:
+            return _interrupted(ckpt)
         failed = [p for p in dump if not dump[p]]
         with open('failed.json', 'w') as f:
             f.write(json.dumps(failed))
@@ -55,12 +149,19 @@ def main():
                 playlist_files = ' '.join(playlist_files)
                 utils.shell(f'open {playlist_files}')
         else:
-            cmds = utils.handle_path(path, args.output_dir, args.audio_only)
-            for cmd in cmds:
-                if args.doit:
-                    os.system(cmd)
-                else:
+            cmds = utils.handle_path(path, args.output_dir, args.audio_only,
+                    args.link_mode, args.incremental)
+            if args.doit:
+                failed = executor.run_albums({path: cmds}, jobs=args.jobs)
+                for album, failures in failed.items():
+                    print(f'Failed to export {album}', file=sys.stderr)
+                    for cmd, error in failures:
+                        print(f'  {cmd}: {error}', file=sys.stderr)
+                return 1 if failed else 0
+            else:
+                for cmd in cmds:
                     print(cmd)
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,9 +1,11 @@
 from functools import cached_property
 import os
+import re
 
 from album_detector import knowledge
 from album_detector import file_info
 from album_detector import utils
+from album_detector import instrument
 
 class DiscInfo:
     def __init__(self, album, cue=None, audio=None):
@@ -13,6 +15,7 @@ class DiscInfo:
         if type(audio) is list:
             self.audio_splitted = True
             self.cue_embedded = False
+            self.audio_files = audio # the tracks of this disc
             track_albums = [a.audio_info['album'] for a in audio]
             track_artists = [a.audio_info['artist'] for a in audio if 'artist' in a.audio_info]
             assert len(set(track_albums)) == 1, str(track_albums)
@@ -51,8 +54,9 @@ class DiscInfo:
                     replaced_audio = replaced_audio_map[self.info['file']]
                     self.info['file'] = os.path.join(cue.dirname, replaced_audio)
                 else:
-                    self.info['file'] = os.path.join(cue.dirname, self.info['file'])
-                    assert os.path.isfile(self.info['file'])
+                    audio_found = album.cue_audio(cue, self.info['file'])
+                    assert len(audio_found) == 1, f'Audio of {cue.fpath}: {audio_found}'
+                    self.info['file'] = audio_found[0]
 
         album.n_disc += 1
         self.disc_no = album.n_disc
@@ -67,8 +71,10 @@ class DiscInfo:
         raise NotImplementedError()
 
 class AlbumInfo:
+    @instrument.timed('AlbumInfo')
     def __init__(self, finfos):
         knowledge.check_fileinfos(finfos)
+        self.index = file_info.DirIndex(finfos)
 
         files = {
                 'cover': [f for f in finfos if 'image(cover)' == f.ftype],
@@ -108,17 +114,7 @@ class AlbumInfo:
         cues = files['cue']
         cue_audios = []
         for cue in cues:
-            cue_audio = os.path.join(cue.dirname, cue.cue_info[0]['file'])
-            if os.path.isfile(cue_audio):
-                cue_audios.append(cue_audio)
-            else: # Try to fix audio file suffix
-                audio_found = []
-                for f in os.listdir(cue.dirname):
-                    f = file_info.FileInfo(os.path.join(cue.dirname, f))
-                    if f.is_audio:
-                        assert f.fpath not in audio_found, 'same disc audio with different format?'
-                        audio_found.append(f.fpath)
-                        cue_audios.append(f.fpath)
+            cue_audios += self.cue_audio(cue, cue.cue_info[0]['file'])
         if len(set(cue_audios)) == 1 and len(cue_audios) > 1: # many cue point to same audio
             cue_audios = [cue_audios[0]] + [''] * (len(cues) - 1)
 
@@ -129,28 +125,18 @@ class AlbumInfo:
             # Merged audio (embedded cue)
             assert all(embedded_cues)
             self.discs = [DiscInfo(album=self, audio=a) for a in self.audio]
-        elif any([os.path.isfile(ca) for ca in cue_audios]):
+        elif any([self.index.is_file(ca) for ca in cue_audios]):
             # Merged audio (explicit cue)
             self.discs = []
             for i in range(len(cues)):
                 cue, ca = cues[i], cue_audios[i]
-                if os.path.isfile(ca):
+                if self.index.is_file(ca):
                     self.discs.append(DiscInfo(album=self, cue=cue))
         else: # Splitted audio
             assert not cues
             self.discs = []
-            attr_cb_list = [lambda a: a.audio_info['album'], lambda a: a.dirname]
-            for attr_cb in attr_cb_list:
-                attr_is_good = True
-                track_list_by_disc = self.cluster_splitted_audio(attr_cb)
-                for track_list in track_list_by_disc:
-                    assert 'track' in track_list[0].audio_info, 'Not implemented: try to recover this piece of info'
-                    track_num_list = [a.track_no for a in track_list]
-                    if len(set(track_num_list)) != len(track_num_list):
-                        attr_is_good = False
-                if attr_is_good:
-                    break
-            assert attr_is_good, 'Failed to divide audios into discs'
+            track_list_by_disc = self.cluster_splitted_audio()
+            assert track_list_by_disc, 'Failed to divide audios into discs'
             for track_list in track_list_by_disc:
                 self.discs.append(DiscInfo(album=self, audio=track_list))
 
@@ -166,14 +152,66 @@ class AlbumInfo:
         self.name = disc_albums[0]
         self.artist = most_freq_artist
 
-    def cluster_splitted_audio(self, get_attr_cb):
-        track_list_by_attr = {}
-        for a in self.audio:
-            track_list = track_list_by_attr.setdefault(get_attr_cb(a), [])
-            track_list.append(a)
-        discs = []
-        for album, track_list in track_list_by_attr.items():
-            track_num_list = [a.track_no for a in track_list]
-            discs.append(track_list)
-        return discs
-
+    def cue_audio(self, cue, fname):
+        """ The audio file fname of cue refers to. If there is no such file,
+        the audio files with the same name but another suffix, or else all
+        audio files next to the cue. """
+        fpath = os.path.join(cue.dirname, fname)
+        if self.index.is_file(fpath):
+            return [fpath]
+        # Try to fix audio file suffix
+        audio_found = [f.fpath for f in self.index.with_stem(fpath) if f.is_audio]
+        if not audio_found:
+            audio_found = [f.fpath for f in self.index.in_dir(cue.dirname) if f.is_audio]
+        return audio_found
+
+    def cluster_splitted_audio(self):
+        """ Divide self.audio into discs by the first of DISC_KEYS giving
+        discs with unique track numbers. Returns the lists of tracks of each
+        disc, in order of appearance, or None. """
+        columns = [[key(a) for a in self.audio] for _, key in DISC_KEYS]
+        track_nos = [a.track_no for a in self.audio]
+        # One pass over the table evaluates every grouping
+        groupings = [{} for _ in columns]
+        seen = [set() for _ in columns]
+        good = [True] * len(columns)
+        for i, track_no in enumerate(track_nos):
+            for k, column in enumerate(columns):
+                if not good[k]:
+                    continue
+                key = column[i]
+                if (key, track_no) in seen[k]:
+                    good[k] = False
+                    continue
+                seen[k].add((key, track_no))
+                groupings[k].setdefault(key, []).append(i)
+        for k, grouping in enumerate(groupings):
+            if good[k]:
+                discs = [[self.audio[i] for i in indexes] for indexes in grouping.values()]
+                for track_list in discs:
+                    assert 'track' in track_list[0].audio_info, 'Not implemented: try to recover this piece of info'
+                return discs
+        return None
+
+def _disc_number(a):
+    match = re.match(r'\s*(\d+)', a.audio_info.get('disc', ''))
+    return int(match.group(1)) if match else None
+
+# Disc (or disc and track) number in file names: 1-01, CD2_05, Disc 1 - 03
+_DISC_PREFIX = re.compile(r'(?i)(?:cd|disc|disk)?[ _.]*(\d{1,2})[ _.]*[-_.][ _.]*\d{1,3}\D')
+
+def _filename_disc(a):
+    match = _DISC_PREFIX.match(a.basename)
+    return int(match.group(1)) if match else None
+
+# Ways to tell the discs of split audio apart, tried in order
+DISC_KEYS = (
+        ('album', lambda a: a.audio_info.get('album')),
+        ('dirname', lambda a: a.dirname),
+        ('discnumber', _disc_number),
+        ('filename', _filename_disc),
+        ('album+discnumber', lambda a: (a.audio_info.get('album'), _disc_number(a))),
+        )
+
+instrument.instrument_class(DiscInfo)
+instrument.instrument_class(AlbumInfo)
@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+def write_atomic(fpath, data, prefix='.tmp-'):
+    """ Replace the content of fpath with data (str) atomically. The file
+    keeps its mode, or gets the mode open() would give a new one. """
+    dirname = os.path.dirname(os.path.abspath(fpath))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=prefix, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            # mkstemp creates files readable by their owner only
+            os.fchmod(f.fileno(), _file_mode(fpath))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, fpath)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+def _file_mode(fpath):
+    try:
+        return os.stat(fpath).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
@@ -0,0 +1,389 @@
+import os
+import struct
+
+# Keys are translated the same way libavformat does, so that the result is
+# interchangeable with the 'tags' of `ffprobe -show_format`.
+_VORBIS_KEYS = {
+        'ALBUMARTIST': 'album_artist',
+        'TRACKNUMBER': 'track',
+        'DISCNUMBER': 'disc',
+        'DESCRIPTION': 'comment',
+        }
+
+_ID3V2_KEYS = {
+        'TALB': 'album',
+        'TCOM': 'composer',
+        'TCON': 'genre',
+        'TCOP': 'copyright',
+        'TENC': 'encoded_by',
+        'TIT2': 'title',
+        'TLAN': 'language',
+        'TPE1': 'artist',
+        'TPE2': 'album_artist',
+        'TPE3': 'performer',
+        'TPOS': 'disc',
+        'TPUB': 'publisher',
+        'TRCK': 'track',
+        'TSSE': 'encoder',
+        'TYER': 'date',
+        'TDRC': 'date',
+        'TDRL': 'date',
+        'TCMP': 'compilation',
+        'TSOA': 'album-sort',
+        'TSOP': 'artist-sort',
+        'TSOT': 'title-sort',
+        'TIT1': 'grouping',
+        # ID3v2.2
+        'TAL': 'album',
+        'TCM': 'composer',
+        'TCO': 'genre',
+        'TT2': 'title',
+        'TEN': 'encoded_by',
+        'TP1': 'artist',
+        'TP2': 'album_artist',
+        'TP3': 'performer',
+        'TRK': 'track',
+        'TPA': 'disc',
+        'TYE': 'date',
+        }
+
+_MP4_KEYS = {
+        b'\xa9alb': 'album',
+        b'\xa9ART': 'artist',
+        b'aART': 'album_artist',
+        b'\xa9cmt': 'comment',
+        b'\xa9day': 'date',
+        b'\xa9gen': 'genre',
+        b'\xa9nam': 'title',
+        b'\xa9too': 'encoder',
+        b'\xa9wrt': 'composer',
+        b'\xa9lyr': 'lyrics',
+        b'\xa9grp': 'grouping',
+        b'cprt': 'copyright',
+        b'desc': 'description',
+        b'soal': 'sort_album',
+        b'soar': 'sort_artist',
+        b'soaa': 'sort_album_artist',
+        b'sonm': 'sort_name',
+        }
+
+_RIFF_INFO_KEYS = {
+        b'IART': 'artist',
+        b'ICMT': 'comment',
+        b'ICOP': 'copyright',
+        b'ICRD': 'date',
+        b'IGNR': 'genre',
+        b'ILNG': 'language',
+        b'INAM': 'title',
+        b'IPRD': 'album',
+        b'IPRT': 'track',
+        b'ITRK': 'track',
+        b'ISFT': 'encoder',
+        b'ISMP': 'timecode',
+        b'ITCH': 'encoded_by',
+        }
+
+_ID3V1_SIZE = 128
+_APE_FOOTER = struct.Struct('<8sIIII8x')
+
+def read_tags(fpath):
+    """ Read the container tags of an audio file without touching the audio
+    payload. Returns None if the format is not supported (the caller shall
+    fall back to ffprobe). """
+    try:
+        with open(fpath, 'rb') as f:
+            return _read_tags(f)
+    except (struct.error, ValueError, IndexError, UnicodeDecodeError):
+        # Truncated or malformed
+        return None
+
+def _read_tags(f):
+    id3_tags = {}
+    header = f.read(10)
+    if header.startswith(b'ID3'):
+        id3_tags = _read_id3v2(f, header)
+        if id3_tags is None:
+            return None
+    else:
+        f.seek(0)
+    start = f.tell()
+    head = f.read(12)
+    f.seek(start)
+
+    if head.startswith(b'fLaC'):
+        f.seek(start + 4)
+        return _read_flac(f) or id3_tags
+    if head.startswith(b'MAC ') or head.startswith(b'tBaK'):
+        return _read_apev2(f) or _read_id3v1(f) or id3_tags
+    if head.startswith(b'TTA1'):
+        tags = dict(id3_tags)
+        tags.update(_read_apev2(f))
+        return tags or _read_id3v1(f)
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return _read_riff(f, id3_tags)
+    if head[4:8] == b'ftyp':
+        return _read_mp4(f, start)
+    if id3_tags or (len(head) >= 2 and head[0] == 0xff and head[1] & 0xe0 == 0xe0):
+        # MPEG audio
+        return id3_tags or _read_id3v1(f)
+    return None
+
+def _add_tag(tags, key, value):
+    if key in tags:
+        tags[key] += ';' + value
+    else:
+        tags[key] = value
+
+def _read_flac(f):
+    tags = {}
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            raise ValueError('Truncated FLAC metadata')
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7f
+        size = int.from_bytes(header[1:], 'big')
+        if block_type == 4: # VORBIS_COMMENT
+            _parse_vorbis_comment(f.read(size), tags)
+        else:
+            f.seek(size, os.SEEK_CUR)
+    return tags
+
+def _parse_vorbis_comment(data, tags):
+    vendor_len, = struct.unpack_from('<I', data, 0)
+    offset = 4 + vendor_len
+    n_comments, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    for _ in range(n_comments):
+        length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        comment = data[offset:offset + length].decode('utf-8', errors='replace')
+        offset += length
+        key, sep, value = comment.partition('=')
+        if not sep or key.upper() == 'METADATA_BLOCK_PICTURE':
+            continue
+        key = key.upper()
+        _add_tag(tags, _VORBIS_KEYS.get(key, key), value)
+
+def _syncsafe(data):
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+def _decode_id3_text(data):
+    enc, data = data[0], data[1:]
+    if enc == 0:
+        text = data.decode('latin-1')
+    elif enc == 1:
+        text = data.decode('utf-16', errors='replace')
+    elif enc == 2:
+        text = data.decode('utf-16-be', errors='replace')
+    elif enc == 3:
+        text = data.decode('utf-8', errors='replace')
+    else:
+        raise ValueError(f'Unknown ID3 text encoding {enc}')
+    # Every UTF-16 string of a frame carries its own BOM
+    return [s.lstrip('\ufeff') for s in text.split('\x00')]
+
+def _read_id3v2(f, header):
+    if len(header) < 10:
+        raise ValueError('Truncated ID3v2 header')
+    major, flags = header[3], header[5]
+    size = _syncsafe(header[6:10])
+    data = f.read(size)
+    if flags & 0x10: # footer present
+        f.seek(10, os.SEEK_CUR)
+    if major not in (2, 3, 4):
+        return None
+    if flags & 0x80 and major < 4:
+        data = data.replace(b'\xff\x00', b'\xff')
+    offset = 0
+    if flags & 0x40 and major >= 3: # extended header
+        if major == 3:
+            offset = 4 + struct.unpack_from('>I', data, 0)[0]
+        else:
+            offset = _syncsafe(data[0:4])
+
+    id_len = 3 if major == 2 else 4
+    header_len = 6 if major == 2 else 10
+    tags = {}
+    while offset + header_len <= len(data):
+        frame_id = data[offset:offset + id_len]
+        if not frame_id.strip(b'\x00'):
+            break # padding
+        frame_id = frame_id.decode('latin-1')
+        if major == 2:
+            frame_size = int.from_bytes(data[offset + 3:offset + 6], 'big')
+            frame_flags = 0
+        elif major == 3:
+            frame_size = struct.unpack_from('>I', data, offset + 4)[0]
+            frame_flags = struct.unpack_from('>H', data, offset + 8)[0]
+        else:
+            frame_size = _syncsafe(data[offset + 4:offset + 8])
+            frame_flags = struct.unpack_from('>H', data, offset + 8)[0]
+        offset += header_len
+        body = data[offset:offset + frame_size]
+        offset += frame_size
+
+        if major == 3 and frame_flags & 0x00c0:
+            continue # compressed or encrypted
+        if major == 4:
+            if frame_flags & 0x000c:
+                continue # compressed or encrypted
+            if frame_flags & 0x0001: # data length indicator
+                body = body[4:]
+            if frame_flags & 0x0002 or flags & 0x80:
+                body = body.replace(b'\xff\x00', b'\xff')
+        if not body:
+            continue
+
+        if frame_id in ('TXXX', 'TXX'):
+            fields = _decode_id3_text(body)
+            if len(fields) >= 2:
+                _add_tag(tags, fields[0], fields[1])
+        elif frame_id in ('COMM', 'COM'):
+            # encoding, language, description, text
+            fields = _decode_id3_text(body[:1] + body[4:])
+            if len(fields) >= 2:
+                tags[fields[0] or 'comment'] = fields[1]
+        elif frame_id.startswith('T'):
+            tags[_ID3V2_KEYS.get(frame_id, frame_id)] = _decode_id3_text(body)[0]
+    return tags
+
+def _read_id3v1(f):
+    f.seek(0, os.SEEK_END)
+    if f.tell() < _ID3V1_SIZE:
+        return {}
+    f.seek(-_ID3V1_SIZE, os.SEEK_END)
+    data = f.read(_ID3V1_SIZE)
+    if not data.startswith(b'TAG'):
+        return {}
+    tags = {}
+    fields = {'title': data[3:33], 'artist': data[33:63], 'album': data[63:93], 'date': data[93:97], 'comment': data[97:127]}
+    for key, value in fields.items():
+        value = value.split(b'\x00')[0].decode('latin-1').strip()
+        if value:
+            tags[key] = value
+    if data[125] == 0 and data[126] != 0:
+        tags['track'] = str(data[126])
+    return tags
+
+def _read_apev2(f):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    for footer_pos in (end - _APE_FOOTER.size, end - _ID3V1_SIZE - _APE_FOOTER.size):
+        if footer_pos < 0:
+            continue
+        f.seek(footer_pos)
+        footer = f.read(_APE_FOOTER.size)
+        if footer.startswith(b'APETAGEX'):
+            break
+    else:
+        return {}
+    _, _, size, n_items, _ = _APE_FOOTER.unpack(footer)
+    f.seek(footer_pos + _APE_FOOTER.size - size)
+    data = f.read(size - _APE_FOOTER.size)
+    tags = {}
+    offset = 0
+    for _ in range(n_items):
+        value_size, item_flags = struct.unpack_from('<II', data, offset)
+        offset += 8
+        key_end = data.index(b'\x00', offset)
+        key = data[offset:key_end].decode('ascii')
+        offset = key_end + 1
+        value = data[offset:offset + value_size]
+        offset += value_size
+        if (item_flags >> 1) & 0x3 == 0: # UTF-8 text, binary items are attachments
+            tags[key] = value.decode('utf-8', errors='replace')
+    return tags
+
+def _iter_boxes(f, end):
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        if size == 1:
+            size, = struct.unpack('>Q', f.read(8))
+        elif size == 0:
+            size = end - start
+        if size < 8:
+            raise ValueError('Malformed MP4 box')
+        yield box_type, start + size
+        f.seek(start + size)
+
+def _find_box(f, end, path):
+    for box_type, box_end in _iter_boxes(f, end):
+        if box_type == path[0]:
+            if box_type == b'meta':
+                f.seek(4, os.SEEK_CUR) # full box version and flags
+            if len(path) == 1:
+                return box_end
+            return _find_box(f, box_end, path[1:])
+    return None
+
+def _read_mp4(f, start):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    f.seek(start)
+    ilst_end = _find_box(f, end, [b'moov', b'udta', b'meta', b'ilst'])
+    if ilst_end is None:
+        return None # tags elsewhere are left to ffprobe
+    data = f.read(ilst_end - f.tell())
+    tags = {}
+    offset = 0
+    while offset + 8 <= len(data):
+        item_size, item_type = struct.unpack_from('>I4s', data, offset)
+        if item_size < 8:
+            raise ValueError('Malformed MP4 item')
+        item = data[offset + 8:offset + item_size]
+        offset += item_size
+        key, value = None, None
+        child = 0
+        while child + 8 <= len(item):
+            child_size, child_type = struct.unpack_from('>I4s', item, child)
+            if child_size < 8:
+                raise ValueError('Malformed MP4 item')
+            payload = item[child + 8:child + child_size]
+            child += child_size
+            if child_type == b'name':
+                key = payload[4:].decode('utf-8', errors='replace')
+            elif child_type == b'data':
+                data_type, value = struct.unpack_from('>I', payload, 0)[0], payload[8:]
+        if value is None:
+            continue
+        if item_type in (b'trkn', b'disk'):
+            number, total = struct.unpack_from('>HH', value, 2)
+            tags['track' if item_type == b'trkn' else 'disc'] = f'{number}/{total}' if total else f'{number}'
+        elif data_type == 1: # UTF-8
+            if item_type == b'----':
+                if key:
+                    tags[key] = value.decode('utf-8', errors='replace')
+            elif item_type in _MP4_KEYS:
+                tags[_MP4_KEYS[item_type]] = value.decode('utf-8', errors='replace')
+    return tags
+
+def _read_riff(f, id3_tags):
+    riff_size = struct.unpack('<4sI4s', f.read(12))[1]
+    if riff_size == 0xffffffff:
+        return None
+    end = 8 + riff_size
+    tags = {}
+    while f.tell() + 8 <= end:
+        chunk_id, size = struct.unpack('<4sI', f.read(8))
+        chunk_end = f.tell() + size + (size & 1)
+        if chunk_id == b'LIST' and size < 4:
+            return None # malformed, reading the list would read the whole file
+        if chunk_id == b'LIST' and f.read(4) == b'INFO':
+            info = f.read(size - 4)
+            offset = 0
+            while offset + 8 <= len(info):
+                sub_id, sub_size = struct.unpack_from('<4sI', info, offset)
+                value = info[offset + 8:offset + 8 + sub_size].split(b'\x00')[0]
+                offset += 8 + sub_size + (sub_size & 1)
+                if value:
+                    key = _RIFF_INFO_KEYS.get(sub_id, sub_id.decode('latin-1'))
+                    tags[key] = value.decode('utf-8', errors='replace')
+        elif chunk_id in (b'id3 ', b'ID3 '):
+            header = f.read(10)
+            if header.startswith(b'ID3'):
+                tags.update(_read_id3v2(f, header) or {})
+        f.seek(chunk_end)
+    return {**id3_tags, **tags}
@@ -0,0 +1,72 @@
+import atexit
+import json
+import os
+import time
+
+# Seconds between fsyncs of the checkpoint file
+FSYNC_INTERVAL = 5.0
+
+class Checkpoint:
+    """ Results of a scan streamed to a JSON-lines file, one
+    {"path": ..., "result": ...} per album, as soon as the album is done.
+    With resume, the results already in the file are loaded and new ones
+    are appended; otherwise the file is started over. """
+    def __init__(self, fpath, resume=False, fsync_interval=FSYNC_INTERVAL):
+        self.fpath = fpath
+        self.fsync_interval = fsync_interval
+        self.results = load(fpath) if resume else {}
+        self._f = open(fpath, 'a' if resume else 'w')
+        if resume and not _terminated(fpath):
+            self._f.write('\n') # do not append to a line cut short
+        self._last_sync = time.monotonic()
+
+    def __contains__(self, path):
+        return path in self.results
+
+    def record(self, path, result):
+        self.results[path] = result
+        self._f.write(json.dumps({'path': path, 'result': result}) + '\n')
+        self._f.flush()
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._f.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_checkpoint(fpath, resume=False):
+    ckpt = Checkpoint(fpath, resume)
+    atexit.register(ckpt.close)
+    return ckpt
+
+def load(fpath):
+    """ Returns {path: result}. A line cut short by a crash is ignored. """
+    retval = {}
+    if not os.path.isfile(fpath):
+        return retval
+    with open(fpath, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            retval[record['path']] = record['result']
+    return retval
+
+def _terminated(fpath):
+    with open(fpath, 'rb') as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+
+from album_detector import audio_tags
+from album_detector import knowledge
+
+# Extensions of the audio files ftype_rules may classify as audio. Album
+# boundaries are guessed from names, the albums found are classified
+# properly when processed.
+AUDIO_FEXTS = {'flac', 'ape', 'tta', 'tak', 'wav', 'mp3', 'm4a', 'ogg', 'wma'}
+
+# CD1, Disc 2, [DISC.3], disk_04: a whole word followed by a number, so that
+# names like 'Discovery' are not taken for discs
+_DISC_NAME = re.compile(r'(?<![^\W_])(CD|Dis[ck])[ ._-]*\d+(?![^\W_])', re.IGNORECASE)
+
+def is_disc_name(name):
+    """ Names like CD1, Disc 2 or 'Some Album [DISC.3]' """
+    return _DISC_NAME.search(name) is not None
+
+class _Dir:
+    """ A directory of the walk, until its subtree is done """
+    __slots__ = ('path', 'n_files', 'has_audio', 'album', 'held', 'split')
+
+    def __init__(self, path):
+        self.path = path
+        self.n_files = 1 # as counted by utils.mkfilelist, the directory itself included
+        self.has_audio = False
+        self.album = None # album tag of its first audio file
+        # Subtrees with audio which may turn out to be discs of this album
+        self.held = []
+        # Set once they cannot, later subtrees with audio are albums of their own
+        self.split = False
+
+    @property
+    def is_disc(self):
+        return is_disc_name(os.path.basename(self.path))
+
+def _album_tag(fpath):
+    tags = audio_tags.read_tags(fpath)
+    if not tags:
+        return None
+    tags = {k.lower(): v for k, v in tags.items()}
+    return tags.get('album')
+
+def _mergeable(held, max_files):
+    """ Whether the subtrees in held can be the discs of one album: named
+    like discs, or tagged with names which only differ in disc numbers. """
+    if sum(d.n_files for d in held) > max_files:
+        return False
+    if all(d.is_disc for d in held):
+        return True
+    albums = [d.album for d in held]
+    if None in albums or len(set(albums)) != len(albums):
+        return False
+    return len({knowledge.norm_album_name(a) for a in albums}) == 1
+
+def _scan_dir(path):
+    """ Returns the _Dir of path, with its files counted, and its
+    subdirectories """
+    d = _Dir(path)
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+                continue
+            d.n_files += 1
+            if not d.has_audio and entry.name.split('.')[-1].lower() in AUDIO_FEXTS:
+                d.has_audio = True
+                d.album = _album_tag(entry.path)
+    subdirs.sort(reverse=True) # popped from the end
+    return d, subdirs
+
+def find_albums(root, max_files=200):
+    """ Yield the album directories below root, each as soon as the walk is
+    done with the subtree it depends on. A directory with audio files is an
+    album; subdirectories with audio files are merged into it as well as
+    into a directory without audio whose subdirectories look like the discs
+    of one album. Only the directories being walked are kept in memory. """
+    d, subdirs = _scan_dir(root)
+    stack = [(d, subdirs)]
+    while stack:
+        d, subdirs = stack[-1]
+        if subdirs:
+            stack.append(_scan_dir(subdirs.pop()))
+            continue
+        stack.pop()
+        yield from _finish(d, stack[-1][0] if stack else None, max_files)
+
+def _finish(d, parent, max_files):
+    """ d is done: yield what is known to be an album, hand the rest to
+    parent """
+    if not d.has_audio:
+        if d.held and (len(d.held) > 1 or d.held[0].is_disc) and not d.split:
+            # An album of discs
+            d.has_audio = True
+            d.album = knowledge.norm_album_name(d.held[0].album or '') or None
+            d.n_files += sum(h.n_files for h in d.held)
+        else:
+            for h in d.held:
+                yield h.path
+        d.held = []
+    if parent is None:
+        if d.has_audio:
+            yield d.path
+        return
+    if not d.has_audio:
+        parent.n_files += d.n_files # scans, covers and the like
+    elif parent.has_audio:
+        parent.n_files += d.n_files
+    elif parent.split:
+        yield d.path
+    else:
+        parent.held.append(d)
+        if not _mergeable(parent.held, max_files):
+            if sum(h.n_files for h in parent.held) > max_files:
+                print(f'More than {max_files} files in {parent.path}, '
+                        'its subdirectories are taken as separate albums', file=sys.stderr)
+            for h in parent.held:
+                yield h.path
+            parent.held = []
+            parent.split = True
@@ -0,0 +1,75 @@
+import os
+from concurrent import futures
+
+def _dependencies(ops):
+    """ An operation depends on the operations producing its inputs and the
+    directories its outputs are created in. Anything else may run in
+    parallel. """
+    producers = {}
+    deps = []
+    for i, op in enumerate(ops):
+        d = set()
+        for path in op.inputs:
+            if path in producers:
+                d.add(producers[path])
+        for path in op.outputs:
+            parent = os.path.dirname(path)
+            while parent and parent != os.path.dirname(parent):
+                if parent in producers:
+                    d.add(producers[parent])
+                    break
+                parent = os.path.dirname(parent)
+        deps.append(d)
+        for path in op.outputs:
+            producers[path] = i
+    return deps
+
+def run_commands(cmds, jobs=1):
+    """ Run the export operations of an album, independent ones in parallel.
+    Returns a list of (operation, error) for the operations that failed or
+    were skipped because an operation they depend on failed. """
+    deps = _dependencies(cmds)
+    dependents = [[] for _ in cmds]
+    for i, d in enumerate(deps):
+        for j in d:
+            dependents[j].append(i)
+    n_waiting = [len(d) for d in deps]
+    failures = []
+
+    def skip(i, reason):
+        failures.append((cmds[i], reason))
+        for j in dependents[i]:
+            if n_waiting[j] is not None:
+                n_waiting[j] = None
+                skip(j, f'Skipped, depends on {cmds[i]}')
+
+    with futures.ThreadPoolExecutor(max(1, jobs)) as pool:
+        running = {}
+        def submit_ready():
+            for i, n in enumerate(n_waiting):
+                if n == 0:
+                    n_waiting[i] = None
+                    running[pool.submit(cmds[i].run)] = i
+        submit_ready()
+        while running:
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    skip(i, str(error))
+                    continue
+                for j in dependents[i]:
+                    if n_waiting[j] is not None:
+                        n_waiting[j] -= 1
+            submit_ready()
+    return failures
+
+def run_albums(cmds_by_album, jobs=1):
+    """ Returns {album: failures} for the albums which did not export cleanly """
+    retval = {}
+    for album, cmds in cmds_by_album.items():
+        failures = run_commands(cmds, jobs)
+        if failures:
+            retval[album] = failures
+    return retval
@@ -1,33 +1,41 @@
 import os
 
-def export_cmds(album, output_dir, audio_only=False):
+from album_detector import manifest
+from album_detector.operations import Mkdir, Copy, Transcode, Chmod
+
+def export_cmds(album, output_dir, audio_only=False, link_mode='copy', incremental=False):
+    """ Returns the operations exporting album, see operations.py. Files
+    exported as they are get copied or linked according to link_mode.
+    With incremental, operations already done by an earlier export (as
+    recorded by its manifest) are left out. """
     retval = []
     album_dir = os.path.join(output_dir, album.artist, album.name)
-    retval.append(f'mkdir -p "{album_dir}"')
+    retval.append(Mkdir(album_dir))
 
     if album.cover:
-        retval.append(f'cp "{album.cover.fpath}" "{album_dir}/cover.{album.cover.fext}"')
+        retval.append(Copy(album.cover.fpath, f'{album_dir}/cover.{album.cover.fext}', link_mode))
 
     if not audio_only:
-        if album.cover or album.booklets:
-            retval.append(f'mkdir -p "{album_dir}/images"')
-        for f in album.booklets:
-            retval.append(f'cp "{f.fpath}" "{album_dir}/images"')
-
-        if album.logs:
-            retval.append(f'mkdir -p "{album_dir}/logs"')
-        for f in album.logs:
-            retval.append(f'cp "{f.fpath}" "{album_dir}/logs"')
-
-        if album.mv:
-            retval.append(f'mkdir -p "{album_dir}/mv"')
-        for f in album.mv:
-            retval.append(f'cp "{f.fpath}" "{album_dir}/mv"')
+        for subdir, files in [('images', album.booklets), ('logs', album.logs), ('mv', album.mv)]:
+            if subdir == 'images' and album.cover or files:
+                retval.append(Mkdir(f'{album_dir}/{subdir}'))
+            for f in files:
+                retval.append(Copy(f.fpath, f'{album_dir}/{subdir}/{f.basename}', link_mode))
 
     for disc in album.discs:
-        retval += _disc_cmds(disc, album_dir)
+        retval += _disc_cmds(disc, album_dir, link_mode)
 
-    retval.append(f'find "{album_dir}" -type f -exec chmod 0644 {{}} \\;')
+    all_ops = retval
+    if incremental:
+        retval = manifest.outdated(retval, album_dir)
+
+    # Copies are created with the right permissions and links must keep
+    # those of their source, only files written by ffmpeg need fixing
+    transcoded = [out for op in retval if isinstance(op, Transcode) for out in op.outputs]
+    if transcoded:
+        retval.append(Chmod(transcoded))
+    if incremental and retval:
+        retval.append(manifest.WriteManifest(album_dir, all_ops))
 
     return retval
 
@@ -36,7 +44,7 @@ def export_m3u(album):
     for disc in album.discs:
         filelist = []
         assert disc.audio_splitted
-        for a in disc.album.audio:
+        for a in disc.audio_files:
             filelist.append(a.fpath)
         playlist = '\n'.join(filelist).replace('[', '%5b').replace(']', '%5d')
         playlists.append(playlist)
@@ -48,14 +56,14 @@ def export_cue(album):
 def _output_filename(disc, track_no, ext):
     return 'disc%d-%.2d.%s' % (disc.disc_no, track_no, ext)
 
-def _disc_cmds(disc, output_dir):
+def _disc_cmds(disc, output_dir, link_mode):
     if not disc.audio_splitted:
         return _ffmpeg_cmds(disc, output_dir)
     else:
         retval = []
-        for a in disc.album.audio:
+        for a in disc.audio_files:
             out_fname = _output_filename(disc, a.track_no, a.fext)
-            retval.append(f'cp "{a.fpath}" "{output_dir}/{out_fname}"')
+            retval.append(Copy(a.fpath, f'{output_dir}/{out_fname}', link_mode))
         return retval
 
 def _disc_cue(disc):
@@ -85,35 +93,43 @@ FILE "{filename}" WAVE"""
     return retval
 
 def _ffmpeg_cmds(disc, output_dir):
+    """ One ffmpeg run per source audio. The source is decoded once and
+    every track is written as a separate output of that run. """
     retval = []
-    for track in disc.tracks:
-        metadata = {
-            'artist': track['artist'],
-            'title': track['title'],
-            'album': track['album'],
-            'track': str(track['track']) + '/' + str(len(disc.tracks))
-        }
-        if disc.cue_embedded:
-            metadata['cuesheet'] = ''
-    
-        if 'genre' in track:
-            track['genre'] = track['genre']
-        if 'date' in track:
-            track['date'] = track['date']
-    
-        cmd = 'ffmpeg'
-        cmd += ' -i "%s"' % disc.info['file']
-        cmd += ' -ss %.2d:%.2d:%07.4f' % (track['start'] / 60 / 60 / 75, track['start'] / 60 / 75 % 60, track['start'] / 75 % 60)
-        cmd += ' -compression_level 12'
-    
-        if 'duration' in track:
-            cmd += ' -t %.2d:%.2d:%07.4f' % (track['duration'] / 60 / 60 / 75, track['duration'] / 60 / 75 % 60, track['duration'] / 75 % 60)
-    
-        cmd += ' ' + ' '.join('-metadata %s="%s"' % (k, v) for (k, v) in metadata.items())
-        out_fname = _output_filename(disc, track['track'], 'flac')
-        out_fname = os.path.join(output_dir, out_fname)
-        cmd += f' "{out_fname}"'
-    
-        retval.append(cmd)
+    for source, tracks in _tracks_by_source(disc):
+        retval.append(Transcode(source, [_ffmpeg_output(disc, track, output_dir) for track in tracks]))
     return retval
 
+def _tracks_by_source(disc):
+    """ Group consecutive tracks by the audio file they are cut from """
+    first_file = disc.tracks[0].get('file')
+    groups = []
+    for track in disc.tracks:
+        track_file = track.get('file', first_file)
+        if track_file == first_file:
+            source = disc.info['file']
+        else:
+            source = os.path.join(os.path.dirname(disc.info['file']), track_file)
+        if not groups or groups[-1][0] != source:
+            groups.append((source, []))
+        groups[-1][1].append(track)
+    return groups
+
+def _ffmpeg_output(disc, track, output_dir):
+    metadata = {
+        'artist': track['artist'],
+        'title': track['title'],
+        'album': track['album'],
+        'track': str(track['track']) + '/' + str(len(disc.tracks))
+    }
+    if disc.cue_embedded:
+        metadata['cuesheet'] = ''
+
+    if 'genre' in track:
+        track['genre'] = track['genre']
+    if 'date' in track:
+        track['date'] = track['date']
+
+    out_fname = _output_filename(disc, track['track'], 'flac')
+    out_fname = os.path.join(output_dir, out_fname)
+    return track['start'], track.get('duration'), metadata, out_fname
@@ -1,107 +1,264 @@
-from functools import cached_property
+import asyncio
+import collections
 import os
+import sys
 import json
 import re
 
 from album_detector import utils
+from album_detector import magic_bytes
+from album_detector import audio_tags
+from album_detector import probe_cache
+from album_detector import instrument
+from album_detector import ftype_rules
 
-def parse_cue(cue_str):
+# Seconds a single `file` or `ffprobe` call may take
+probe_timeout = 300
+
+FTYPES = ftype_rules.FTYPES
+
+@instrument.timed('prefetch')
+def prefetch(finfos):
+    """ Run the external probes of all finfos concurrently, so that later
+    accesses to type_str and audio_info are served from memory. """
+    async def _prefetch():
+        await asyncio.gather(*[f._prefetch_type_str() for f in finfos])
+        await asyncio.gather(*[f._prefetch_audio_info() for f in finfos])
+    asyncio.run(_prefetch())
+
+def _unquote(s):
+    return s.replace('"', '')
+
+def _cue_frames(msf):
+    # unit of the last field is frame (a.k.a. 1/75 sec)
+    t = [int(n, 10) for n in _unquote(msf).split(':')]
+    if len(t) != 3 or t[2] >= 75:
+        raise ValueError(f'Malformed time {msf}')
+    return 75 * (60 * t[0] + t[1]) + t[2]
+
+class _CueParser:
+    def __init__(self):
+        self.general = {}
+        self.tracks = []
+        self.file = None
+        self.warnings = []
+
+    @property
+    def scope(self):
+        # Commands before the first TRACK apply to the whole disc
+        return self.tracks[-1] if self.tracks else self.general
+
+    def rem(self, args):
+        key, _, value = args.partition(' ')
+        key = key.lower()
+        if not key or key in _CUE_RESERVED_KEYS:
+            return False
+        self.scope[key] = _unquote(value.strip())
+        return True
+
+    def performer(self, args):
+        self.scope['artist'] = _unquote(args)
+        return True
+
+    def title(self, args):
+        self.scope['title' if self.tracks else 'album'] = _unquote(args)
+        return True
+
+    def songwriter(self, args):
+        self.scope['songwriter'] = _unquote(args)
+        return True
+
+    def catalog(self, args):
+        self.general['catalog'] = _unquote(args)
+        return True
+
+    def cdtextfile(self, args):
+        self.general['cdtextfile'] = _unquote(args)
+        return True
+
+    def file(self, args):
+        self.file = _unquote(args.rsplit(' ', 1)[0])
+        self.general.setdefault('file', self.file)
+        self.general.setdefault('files', []).append(self.file)
+        return True
+
+    def track(self, args):
+        track = self.general.copy()
+        track.pop('files', None)
+        if self.file is not None:
+            track['file'] = self.file
+        track['track'] = int(args.split(' ')[0], 10)
+        self.tracks.append(track)
+        return True
+
+    def index(self, args):
+        if not self.tracks:
+            return False
+        number, _, msf = args.partition(' ')
+        number = int(number, 10)
+        if number == 1:
+            self.tracks[-1]['start'] = _cue_frames(msf)
+            if self.file is not None:
+                # The track starts in the latest FILE, not necessarily the
+                # one it was declared in
+                self.tracks[-1]['file'] = self.file
+        elif number == 0:
+            self.tracks[-1]['index00'] = _cue_frames(msf)
+        return True
+
+    def pregap(self, args):
+        if not self.tracks:
+            return False
+        self.tracks[-1]['pregap'] = _cue_frames(args)
+        return True
+
+    def postgap(self, args):
+        if not self.tracks:
+            return False
+        self.tracks[-1]['postgap'] = _cue_frames(args)
+        return True
+
+    def isrc(self, args):
+        if not self.tracks:
+            return False
+        self.tracks[-1]['isrc'] = _unquote(args)
+        return True
+
+    def flags(self, args):
+        if not self.tracks:
+            return False
+        self.tracks[-1]['flags'] = args.split()
+        return True
+
+# Keys set by commands, a REM line shall not override them
+_CUE_RESERVED_KEYS = {'artist', 'album', 'title', 'file', 'files', 'track', 'start', 'duration'}
+
+_CUE_COMMANDS = {
+        'REM': _CueParser.rem,
+        'PERFORMER': _CueParser.performer,
+        'TITLE': _CueParser.title,
+        'SONGWRITER': _CueParser.songwriter,
+        'CATALOG': _CueParser.catalog,
+        'CDTEXTFILE': _CueParser.cdtextfile,
+        'FILE': _CueParser.file,
+        'TRACK': _CueParser.track,
+        'INDEX': _CueParser.index,
+        'PREGAP': _CueParser.pregap,
+        'POSTGAP': _CueParser.postgap,
+        'ISRC': _CueParser.isrc,
+        'FLAGS': _CueParser.flags,
+        }
+
+@instrument.timed('parse_cue')
+def parse_cue(cue_str, warnings=None):
+    """ Returns (general, tracks). Lines which cannot be understood are
+    skipped and appended to warnings, if given. A malformed TRACK line
+    raises ValueError. """
     cue_str = cue_str.replace('\ufeff', '') # Remove BOM
-    cue_str = cue_str.replace('\r\n', '\n')
-    d = cue_str.split('\n')
-    general = {}
-    tracks = []
-    
-    for line in d:
-        if not line:
+    parser = _CueParser()
+    for line in cue_str.splitlines():
+        command, _, args = line.strip().partition(' ')
+        if not command:
             continue
-        elif line.startswith('REM DISCNUMBER '):
-            pass
-        elif line.startswith('REM TOTALDISCS '):
-            pass
-        elif line.startswith('REM ACCURATERIPID '):
-            pass
-        elif line.startswith('REM CATALOG '):
-            pass
-        elif line.startswith('REM GENRE '):
-            general['genre'] = ' '.join(line.split(' ')[2:])
-        elif line.startswith('REM DATE '):
-            general['date'] = ' '.join(line.split(' ')[2:])
-        elif line.startswith('REM DISCID '):
-            pass
-        elif line.startswith('REM COMMENT '):
-            pass
-        elif line.startswith('REM REPLAYGAIN_TRACK_GAIN '):
-            pass
-        elif line.startswith('REM REPLAYGAIN_ALBUM_GAIN '):
-            pass
-        elif line.startswith('REM REPLAYGAIN_ALBUM_PEAK '):
-            pass
-        elif line.startswith('REM COMPOSER '):
-            pass
-        elif line.startswith('SONGWRITER '):
-            pass
-        elif line.startswith('CATALOG '):
-            pass
-        elif line.startswith('PERFORMER '):
-            general['artist'] = ' '.join(line.split(' ')[1:]).replace('"', '')
-        elif line.startswith('TITLE '):
-            general['album'] = ' '.join(line.split(' ')[1:]).replace('"', '')
-        elif line.startswith('FILE '):
-            general['file'] = ' '.join(line.split(' ')[1:-1]).replace('"', '')
-        elif line.startswith('  TRACK '):
-            track = general.copy()
-            track['track'] = int(line.strip().split(' ')[1], 10)
-            tracks.append(track)
-        elif line.startswith('    SONGWRITER '):
-            pass
-        elif line.startswith('    ISRC '):
-            pass
-        elif line.startswith('    REM GENRE '):
-            pass
-        elif line.startswith('    REM DATE '):
-            pass
-        elif line.startswith('    REM REPLAYGAIN_TRACK_PEAK '):
-            pass
-        elif line.startswith('    REM REPLAYGAIN_TRACK_GAIN '):
-            pass
-        elif line.startswith('    REM COMPOSER '):
-            pass
-        elif line.startswith('    FLAGS PRE'):
-            pass
-        elif line.startswith('    FLAGS DCP'):
-            pass # digital copy permitted
-        elif line.startswith('    TITLE '):
-            tracks[-1]['title'] = ' '.join(line.strip().split(' ')[1:]).replace('"', '')
-        elif line.startswith('    PERFORMER '):
-            tracks[-1]['artist'] = ' '.join(line.strip().split(' ')[1:]).replace('"', '')
-        elif line.startswith('    PREGAP '):
-            # TODO: https://wiki.hydrogenaud.io/index.php?title=EAC_Gap_Settings
-            pass
-        elif line.startswith('    INDEX 00 '):
-            # TODO: https://wiki.hydrogenaud.io/index.php?title=EAC_and_Cue_Sheets
-            pass
-        elif line.startswith('    INDEX 01 '):
-            t = [int(n) for n in ' '.join(line.strip().split(' ')[2:]).replace('"', '').split(':')]
-            tracks[-1]['start'] = 75 * (60 * t[0] + t[1]) + t[2]
-            # unit of t[2] is frame (a.k.a. 1/75 sec)
-            assert t[2] < 75
-        elif line.startswith('    INDEX 02 '):
-            pass
-        elif line.startswith('    INDEX 03 '):
+        handler = _CUE_COMMANDS.get(command.upper())
+        try:
+            understood = handler is not None and handler(parser, args.strip())
+        except ValueError:
+            if handler is _CueParser.track:
+                # Skipping it would give its lines to the previous track
+                raise ValueError(f'Malformed cue line: {line}') from None
+            parser.warnings.append(f'Malformed cue line: {line}')
+            continue
+        if not understood:
+            parser.warnings.append(f'Unknown cue line: {line}')
+
+    tracks = parser.tracks
+    for cur, nxt in zip(tracks, tracks[1:]):
+        # The last track of each file lasts until the end of the file
+        if cur.get('file') == nxt.get('file') and 'start' in cur and 'start' in nxt:
+            cur['duration'] = nxt['start'] - cur['start']
+
+    if warnings is not None:
+        warnings += parser.warnings
+    return parser.general, tracks
+
+# The part of os.stat_result kept by FileInfo
+_Stat = collections.namedtuple('_Stat', ['st_size', 'st_mtime_ns', 'st_ino'])
+
+class _lazy:
+    """ cached_property for FileInfo, which has no __dict__: the value is kept
+    in the slot named after the property plus a trailing underscore """
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.slot = getattr(owner, name + '_')
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self.slot.__get__(obj, owner)
+        except AttributeError:
             pass
-        else:
-            assert False, f'Unknown cue line: {line} (bytes: {line.encode()})'
-    
-    for i in range(len(tracks)):
-        if i != len(tracks) - 1:
-            tracks[i]['duration'] = tracks[i + 1]['start'] - tracks[i]['start']
-    
-    return general, tracks
+        value = self.func(obj)
+        self.slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+class _flag:
+    """ Boolean cached_property for FileInfo. The value and whether it is
+    known yet are two bits of FileInfo._bits. """
+    _n_flags = 0
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.value_bit = 1 << (2 * _flag._n_flags)
+        self.known_bit = self.value_bit << 1
+        _flag._n_flags += 1
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        if obj._bits & self.known_bit:
+            return bool(obj._bits & self.value_bit)
+        value = bool(self.func(obj))
+        self.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        bits = obj._bits & ~self.value_bit | self.known_bit
+        obj._bits = bits | self.value_bit if value else bits
 
 class FileInfo:
-    def __init__(self, fpath):
+    # Millions of instances are alive while indexing a library, keep them
+    # small: no __dict__, booleans as bits and ftype as a small int
+    __slots__ = (
+            'fpath',
+            '_entry',
+            '_index',
+            '_bits',
+            '_stat_',
+            '_class_',
+            'type_str_',
+            'audio_info_',
+            'track_no_',
+            'cue_info_',
+            )
+
+    def __init__(self, fpath, entry=None):
+        """ entry: optional os.DirEntry of fpath, saves stat calls """
         self.fpath = fpath
+        self._entry = entry
+        self._index = None # DirIndex of the album, if any
+        self._bits = 0
+        if entry is not None:
+            self.is_dir = entry.is_dir()
+            self.is_file = entry.is_file()
 
     def __repr__(self):
         return str(self)
@@ -109,45 +266,118 @@ class FileInfo:
     def __str__(self):
         return f'{self.basename}'
 
-    @cached_property
+    @property
     def basename(self):
         return os.path.basename(self.fpath)
 
-    @cached_property
+    @property
     def dirname(self):
         return os.path.dirname(self.fpath)
 
-    @cached_property
+    @property
     def fext(self):
         return self.basename.split('.')[-1].lower()
 
-    @cached_property
+    @_lazy
+    def _stat(self):
+        entry, self._entry = self._entry, None # not needed any more
+        st = entry.stat() if entry is not None else os.stat(self.fpath)
+        return _Stat(st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _probe(self, name, probe, persist=None):
+        """ persist: optional callback, the value probed is not cached if it
+        returns False """
+        value = self._cache_get(name)
+        if value is probe_cache.MISS:
+            value = probe()
+            if persist is None or persist():
+                self._cache_put(name, value)
+        return value
+
+    async def _probe_async(self, name, probe):
+        value = self._cache_get(name)
+        if value is probe_cache.MISS:
+            value = await probe()
+            self._cache_put(name, value)
+        return value
+
+    def _cache_get(self, name):
+        cache = probe_cache.current()
+        if cache is None:
+            return probe_cache.MISS
+        return cache.get(os.path.abspath(self.fpath), self._stat, name)
+
+    def _cache_put(self, name, value):
+        cache = probe_cache.current()
+        if cache is not None:
+            cache.put(os.path.abspath(self.fpath), self._stat, name, value)
+
+    @instrument.timed('FileInfo.type_str')
+    async def _prefetch_type_str(self):
+        # Like ftype, which asks for type_str of regular files only: there is
+        # nothing to read from dangling symlinks, FIFOs and the like
+        if not hasattr(self, 'type_str_') and self.is_file:
+            self.type_str = await self._probe_async('type_str', self._type_str_async)
+
+    @instrument.timed('FileInfo.audio_info')
+    async def _prefetch_audio_info(self):
+        if not hasattr(self, 'audio_info_') and self.is_audio:
+            self.audio_info = await self._probe_async('audio_info', self._audio_info_async)
+
+    # The sync and async probes below only differ in how `file` and
+    # `ffprobe` are run
+
+    @_lazy
     def type_str(self):
-        return utils.shell(
-                f'file "{self.fpath}"').replace(f'{self.fpath}: ', '')
+        return self._probe('type_str', self._type_str)
 
-    @cached_property
-    def _ffprobe(self):
-        if not self.is_audio:
-            return None
-        jsn = utils.shell('ffprobe '
+    def _type_str(self):
+        type_str = self._known_type_str()
+        if type_str is None:
+            type_str = utils.shell(self._file_cmd(), probe_timeout)
+        return type_str
+
+    async def _type_str_async(self):
+        type_str = self._known_type_str()
+        if type_str is None:
+            type_str = await utils.shell_async(self._file_cmd(), probe_timeout)
+        return type_str
+
+    def _known_type_str(self):
+        """ type_str, if known without running `file` """
+        if self.is_dir:
+            return 'directory'
+        return magic_bytes.classify(self.fpath)
+
+    def _file_cmd(self):
+        return f'file -b "{self.fpath}"'
+
+    def _ffprobe_cmd(self):
+        return ('ffprobe '
                 '-loglevel 0 '
                 '-print_format json '
                 '-show_format '
                 f'"{self.fpath}"')
-        return json.loads(jsn)
-    
-    @cached_property
+
+    @_lazy
     def audio_info(self):
         if not self.is_audio:
             return None
-        fmt = self._ffprobe['format']
-        if 'tags' in fmt:
-            return {k.lower(): v for k, v in fmt['tags'].items()}
-        else:
-            return None
+        return self._probe('audio_info', self._audio_info)
+
+    def _audio_info(self):
+        tags = audio_tags.read_tags(self.fpath)
+        if tags is None:
+            tags = _ffprobe_tags(utils.shell(self._ffprobe_cmd(), probe_timeout))
+        return _normalized_tags(tags)
+
+    async def _audio_info_async(self):
+        tags = audio_tags.read_tags(self.fpath)
+        if tags is None:
+            tags = _ffprobe_tags(await utils.shell_async(self._ffprobe_cmd(), probe_timeout))
+        return _normalized_tags(tags)
     
-    @cached_property
+    @_lazy
     def track_no(self):
         if not self.is_audio or 'track' not in self.audio_info:
             return None
@@ -157,7 +387,7 @@ class FileInfo:
         else:
             return int(self.audio_info['track'])
     
-    @cached_property
+    @property
     def embedded_cue(self):
         if self.is_tta_audio or self.is_ape_audio:
             # cannot carry embedded CUE
@@ -169,202 +399,123 @@ class FileInfo:
             return tags['cuesheet'] 
         return None
 
-    @cached_property
-    def is_video(self):
-        if 'mpg' == self.fext and 'MPEG' in self.type_str:
-            return True
-        if 'mov' == self.fext and 'QuickTime' in self.type_str:
-            return True
-        if 'mds' == self.fext: # disc image
-            return True
-        if 'iso' == self.fext: # TODO: not necessarily a video
-            return True
-        if 'mkv' == self.fext:
-            return True
-        return False
-
-    @cached_property
-    def is_image(self):
-        if 'TIFF image' in self.type_str:
-            return True
-        if 'JPEG 2000' in self.type_str:
-            return True
-        if 'JPEG image' in self.type_str:
-            return True
-        if 'PNG image' in self.type_str:
-            return True
-        if 'data' == self.type_str and 'bmp' == self.fext:
-            return True
-        if 'PC bitmap' in self.type_str and 'bmp' == self.fext:
-            return True
-        return False
-
-    @cached_property
+    @_flag
     def is_empty_dir(self):
-        if not os.path.isdir(self.fpath):
+        if not self.is_dir:
             return False
-        return not list(os.listdir(self.fpath))
+        with os.scandir(self.fpath) as it:
+            return next(it, None) is None
 
-    @cached_property
+    @_flag
+    def is_dir(self):
+        return os.path.isdir(self.fpath)
+
+    @_flag
     def is_file(self):
         return os.path.isfile(self.fpath)
 
-    @cached_property
-    def is_cue(self):
-        return 'cue' == self.fext and 'text' in self.type_str
+    @property
+    def ftype(self):
+        return FTYPES[self._class & 0xf]
 
-    @cached_property
-    def is_log(self):
-        if 'accurip' == self.fext and 'text' in self.type_str:
-            return True
-        if 'sfv' == self.fext and 'text' in self.type_str:
-            return True
-        if 'nfo' == self.fext and 'text' in self.type_str:
-            return True
-        if 'txt' == self.fext:
-            return True
-        if 'log' == self.fext:
-            return True
-        if 'album-hint.json' == self.basename:
-            return True
-        return False
+    @property
+    def audio_format(self):
+        """ One of ftype_rules.FORMATS, None if not audio """
+        return ftype_rules.FORMATS[self._class >> 4]
+
+    @_lazy
+    def _class(self):
+        """ ftype and audio format, see ftype_rules.code() """
+        if not self.is_file:
+            return ftype_rules.code('not_file')
+        return ftype_rules.classify(self.fext, self.basename, self.type_str)
 
-    @cached_property
+    @property
     def is_garbage(self):
-        if self.fext.startswith('doc') and 'Microsoft Word' in self.type_str:
-            return True
-        if 'pdf' == self.fext and 'PDF' in self.type_str:
-            return True
-        if 'QuickTimeInstall' in self.basename:
-            return True
-        if 'inf' == self.fext and 'Autorun' in self.type_str:
-            return True
-        if 'ico' == self.fext and 'icon' in self.type_str:
-            return True
-        if 'HTML document' in self.type_str:
-            return True
-        if 'lrc' == self.fext and 'text' in self.type_str:
-            return True
-        if 'srr' == self.fext and 'data' == self.type_str:
-            return True
-        if 'fpl' == self.fext and 'data' == self.type_str:
-            return True
-        if 'Thumbs.db' == self.basename:
-            return True
-        if 'url' == self.fext:
-            return True
-        if 'm3u' == self.fext:
-            return True
-        if 'm3u8' == self.fext:
-            return True
-        if 'inf.xml' == self.basename:
-            return True
-        if 'Apple Desktop Services Store' == self.type_str:
-            # .DS_Store
-            return True
-        if 'AppleDouble encoded Macintosh file' == self.type_str:
-            return True
-        return False
+        return self.ftype == 'garbage'
+
+    @property
+    def is_log(self):
+        return self.ftype == 'log'
+
+    @property
+    def is_video(self):
+        return self.ftype == 'video'
 
-    @cached_property
+    @property
+    def is_cue(self):
+        return self.ftype == 'cue'
+
+    @property
+    def is_image(self):
+        return self.ftype in ('image', 'image(cover)')
+
+    @property
     def is_cover_image(self):
-        if not self.is_image:
-            return False
-        if self.basename.lower().startswith('cover'):
-            return True
-        if self.basename.lower().startswith('folder'):
-            return True
-        return False
+        return self.ftype == 'image(cover)'
 
-    @cached_property
+    @property
     def is_audio(self):
         return self.is_lossy_audio or self.is_lossless_audio
 
-    @cached_property
+    @property
     def is_lossy_audio(self):
-        if 'ogg' == self.fext and 'Vorbis audio' in self.type_str:
-            return True
-        if 'm4a' == self.fext and 'MP4' in self.type_str:
-            return True
-        if 'm4a' == self.fext and 'Apple iTunes' in self.type_str:
-            return True # TODO: this can also be ALAC, which is lossless
-        if 'mp3' == self.fext and 'MPEG ADTS, layer III' in self.type_str:
-            return True
-        if 'mp3' == self.fext and 'Audio file with ID3' in self.type_str:
-            return True
-        if 'wma' == self.fext and 'Microsoft' in self.type_str:
-            return True
-        return False
+        return self.ftype == 'audio(lossy)'
 
-    @cached_property
+    @property
     def is_lossless_audio(self):
-        _fmt = [
-                self.is_tak_audio,
-                self.is_ape_audio,
-                self.is_flac_audio,
-                self.is_tta_audio,
-                self.is_wav_audio,
-                ]
-        return any(_fmt)
-
-    @cached_property
+        return self.ftype == 'audio(lossless)'
+
+    @property
     def is_flac_audio(self):
-        return "FLAC audio" in self.type_str
+        return self.audio_format == 'flac'
 
-    @cached_property
+    @property
     def is_ape_audio(self):
-        return "Monkey's Audio" in self.type_str
+        return self.audio_format == 'ape'
 
-    @cached_property
+    @property
     def is_tta_audio(self):
-        return "True Audio Lossless Audio" in self.type_str
+        return self.audio_format == 'tta'
 
-    @cached_property
+    @property
     def is_tak_audio(self):
-        return 'data' == self.type_str and 'tak' == self.fext
+        return self.audio_format == 'tak'
 
-    @cached_property
+    @property
     def is_wav_audio(self):
-        return 'WAVE audio' in self.type_str
+        return self.audio_format == 'wav'
 
-    @cached_property
-    def ftype(self):
-        """ TODO: Avoid string literals """
-        if not self.is_file:
-            return 'not_file'
-        if self.is_garbage:
-            return 'garbage'
-        if self.is_log and not self.is_cue:
-            return 'log'
-        if self.is_video:
-            return 'video'
-        if self.is_cue:
-            return 'cue'
-        if self.is_lossless_audio:
-            return 'audio(lossless)'
-        if self.is_lossy_audio:
-            return 'audio(lossy)'
-        if self.is_image:
-            return 'image' if not self.is_cover_image else 'image(cover)'
-        return 'unknown'
-
-    @cached_property
+    @_lazy
     def cue_info(self):
+        # The encoding guessed for a CUE may come from a hint, which is not
+        # part of the cache key
+        return tuple(self._probe('cue_info', self._cue_info,
+                persist=lambda: not self._cue_encoding_guessed))
+
+    @_flag
+    def _cue_encoding_guessed(self):
+        """ Set by _cue_info """
+        return False
+
+    def _cue_info(self):
         if self.is_cue:
             try:
                 cue_str = utils.smart_read(self.fpath)
             except UnicodeDecodeError:
+                self._cue_encoding_guessed = True
                 encoding, confidence = utils.detect_encoding(self.fpath)
                 assert encoding is not None
                 if confidence < 90:
-                    for f in os.listdir(self.dirname):
-                        if f.lower().endswith('.cue'):
-                            p = os.path.join(self.dirname, f)
+                    index = self._index or DirIndex.of_dir(self.dirname)
+                    for f in index.in_dir(self.dirname):
+                        if 'cue' == f.fext:
+                            p = f.fpath
                             enc, confid = utils.detect_encoding(p)
                             hit = False
                             _cue = utils.smart_read(p, enc, robust=True)
                             _info, _trk = parse_cue(_cue)
-                            hit = os.path.isfile(os.path.join(self.dirname, _info['file']))
+                            hit = index.is_file(os.path.join(self.dirname, _info['file']))
                             if hit:
                                 # TODO: review and remove this block
                                 assert encoding == enc, 'If this never got triggered, this block can be safely removed'
@@ -374,5 +525,58 @@ class FileInfo:
                 cue_str = utils.smart_read(self.fpath, encoding, robust=True)
         elif self.is_audio:
             cue_str = self.embedded_cue
-        return parse_cue(cue_str)
+        warnings = []
+        retval = parse_cue(cue_str, warnings)
+        for warning in warnings:
+            print(f'{self.fpath}: {warning}', file=sys.stderr)
+        return retval
+
+instrument.instrument_class(FileInfo)
+
+def _ffprobe_tags(jsn):
+    # Only the tags are kept, not the whole ffprobe output
+    return json.loads(jsn)['format'].get('tags')
+
+def _normalized_tags(tags):
+    if tags:
+        return {k.lower(): v for k, v in tags.items()}
+    else:
+        return None
+
+def _stem(basename):
+    return os.path.splitext(basename)[0].lower()
+
+class DirIndex:
+    """ FileInfos of an album by path, by directory and by directory and
+    stem (the basename without extension, in lower case). Lookups need no
+    file system access. """
+    def __init__(self, finfos):
+        self._by_path = {}
+        self._by_dir = {}
+        self._by_stem = {}
+        for f in finfos:
+            f._index = self
+            self._by_path[os.path.normpath(f.fpath)] = f
+            self._by_dir.setdefault(f.dirname, []).append(f)
+            self._by_stem.setdefault((f.dirname, _stem(f.basename)), []).append(f)
+
+    @classmethod
+    def of_dir(cls, dirname):
+        """ Index of a single directory, for FileInfos outside of an album """
+        with os.scandir(dirname) as it:
+            return cls([FileInfo(entry.path, entry) for entry in it])
+
+    def get(self, fpath):
+        return self._by_path.get(os.path.normpath(fpath))
+
+    def is_file(self, fpath):
+        finfo = self.get(fpath)
+        return finfo is not None and finfo.is_file
+
+    def in_dir(self, dirname):
+        return self._by_dir.get(dirname, [])
 
+    def with_stem(self, fpath):
+        """ Files next to fpath with the same name but any extension """
+        dirname, basename = os.path.split(fpath)
+        return self._by_stem.get((dirname, _stem(basename)), [])
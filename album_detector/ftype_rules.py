@@ -0,0 +1,161 @@
+import collections
+import json
+import re
+
+from album_detector import instrument
+
+# Values of FileInfo.ftype
+FTYPES = (
+        'not_file',
+        'garbage',
+        'log',
+        'video',
+        'cue',
+        'audio(lossless)',
+        'audio(lossy)',
+        'image',
+        'image(cover)',
+        'unknown',
+        )
+
+# Values of FileInfo.audio_format
+FORMATS = (None, 'flac', 'ape', 'tta', 'tak', 'wav', 'mp3', 'aac', 'vorbis', 'wma')
+
+class Rule(collections.namedtuple('Rule', ['fext', 'name', 'magic', 'ftype', 'format'],
+        defaults=(None,))):
+    """ A file gets the ftype (and audio format) of the first rule it matches.
+    fext: lower case extension, None for any
+    name: regular expression the whole basename must match, None for any
+    magic: regular expression searched in the `file -b` output, None for any """
+
+_IMAGE = r'TIFF image|JPEG 2000|JPEG image|PNG image'
+_COVER = r'(?i:cover|folder).*'
+
+DEFAULT_RULES = [
+        Rule(None, r'.*\.(?i:doc)[^.]*', r'Microsoft Word', 'garbage'),
+        Rule('pdf', None, r'PDF', 'garbage'),
+        Rule(None, r'.*QuickTimeInstall.*', None, 'garbage'),
+        Rule('inf', None, r'Autorun', 'garbage'),
+        Rule('ico', None, r'icon', 'garbage'),
+        Rule(None, None, r'HTML document', 'garbage'),
+        Rule('lrc', None, r'text', 'garbage'),
+        Rule('srr', None, r'^data$', 'garbage'),
+        Rule('fpl', None, r'^data$', 'garbage'),
+        Rule(None, r'Thumbs\.db', None, 'garbage'),
+        Rule('url', None, None, 'garbage'),
+        Rule('m3u', None, None, 'garbage'),
+        Rule('m3u8', None, None, 'garbage'),
+        Rule(None, r'inf\.xml', None, 'garbage'),
+        Rule(None, None, r'^Apple Desktop Services Store$', 'garbage'),
+        Rule(None, None, r'^AppleDouble encoded Macintosh file$', 'garbage'),
+
+        Rule('accurip', None, r'text', 'log'),
+        Rule('sfv', None, r'text', 'log'),
+        Rule('nfo', None, r'text', 'log'),
+        Rule('txt', None, None, 'log'),
+        Rule('log', None, None, 'log'),
+        Rule(None, r'album-hint\.json', None, 'log'),
+
+        Rule('mpg', None, r'MPEG', 'video'),
+        Rule('mov', None, r'QuickTime', 'video'),
+        Rule('mds', None, None, 'video'), # disc image
+        Rule('iso', None, None, 'video'), # TODO: not necessarily a video
+        Rule('mkv', None, None, 'video'),
+
+        Rule('cue', None, r'text', 'cue'),
+
+        Rule('tak', None, r'^data$', 'audio(lossless)', 'tak'),
+        Rule(None, None, r"Monkey's Audio", 'audio(lossless)', 'ape'),
+        Rule(None, None, r'FLAC audio', 'audio(lossless)', 'flac'),
+        Rule(None, None, r'True Audio Lossless Audio', 'audio(lossless)', 'tta'),
+        Rule(None, None, r'WAVE audio', 'audio(lossless)', 'wav'),
+
+        Rule('ogg', None, r'Vorbis audio', 'audio(lossy)', 'vorbis'),
+        Rule('m4a', None, r'MP4', 'audio(lossy)', 'aac'),
+        Rule('m4a', None, r'Apple iTunes', 'audio(lossy)', 'aac'), # TODO: this can also be ALAC, which is lossless
+        Rule('mp3', None, r'MPEG ADTS, layer III', 'audio(lossy)', 'mp3'),
+        Rule('mp3', None, r'Audio file with ID3', 'audio(lossy)', 'mp3'),
+        Rule('wma', None, r'Microsoft', 'audio(lossy)', 'wma'),
+
+        Rule(None, _COVER, _IMAGE, 'image(cover)'),
+        Rule('bmp', _COVER, r'^data$|PC bitmap', 'image(cover)'),
+        Rule(None, None, _IMAGE, 'image'),
+        Rule('bmp', None, r'^data$|PC bitmap', 'image'),
+        ]
+
+# Rules from --rules come before the default ones
+_user_rules = []
+_rules = list(DEFAULT_RULES)
+# fext: compiled rules applying to it
+_dispatch = {}
+
+def code(ftype, fmt=None):
+    """ ftype and audio format packed into a small int """
+    return FTYPES.index(ftype) | FORMATS.index(fmt) << 4
+
+UNKNOWN = code('unknown')
+_codes = [code(rule.ftype, rule.format) for rule in _rules]
+
+def decode(c):
+    return FTYPES[c & 0xf], FORMATS[c >> 4]
+
+def add_rules(rules):
+    for rule in rules:
+        assert rule.ftype in FTYPES, f'Unknown ftype {rule.ftype}'
+        assert rule.format in FORMATS, f'Unknown audio format {rule.format}'
+        for pattern in (rule.name, rule.magic):
+            if pattern is not None:
+                re.compile(pattern)
+    _user_rules[:0] = rules
+    _rules[:0] = rules
+    _codes[:0] = [code(rule.ftype, rule.format) for rule in rules]
+    _dispatch.clear()
+
+def set_user_rules(rules):
+    """ Replace the rules added so far, e.g. in a worker process, which may
+    have inherited them already """
+    del _user_rules[:]
+    _rules[:] = DEFAULT_RULES
+    _codes[:] = [code(rule.ftype, rule.format) for rule in _rules]
+    add_rules(rules)
+
+def load_rules(fpath):
+    """ Read extra rules from a JSON list of objects with the fields of Rule """
+    with open(fpath, 'r') as f:
+        add_rules([Rule(**r) for r in json.load(f)])
+
+def user_rules():
+    """ Rules added on top of DEFAULT_RULES, for set_user_rules() """
+    return list(_user_rules)
+
+def _compile(fext):
+    """ One regex for all rules applying to fext. The subject is basename and
+    `file -b` output on two lines; the alternatives are tried in rule order
+    and the name of the matching group tells the rule. """
+    alternatives = []
+    for i, rule in enumerate(_rules):
+        if rule.fext is not None and rule.fext != fext:
+            continue
+        name = rule.name if rule.name is not None else '.*'
+        magic = rule.magic if rule.magic is not None else ''
+        alternatives.append(f'(?P<r{i}>(?:{name})\n.*?(?:{magic}))')
+    return re.compile('|'.join(alternatives), re.MULTILINE)
+
+def _label(i):
+    rule = _rules[i]
+    return f'rule {i}: {rule.fext or "*"} {rule.name or "*"} {rule.magic or "*"} -> {rule.ftype}'
+
+def classify(fext, basename, type_str):
+    """ Returns the code (see code()) of the first matching rule """
+    regex = _dispatch.get(fext)
+    if regex is None:
+        regex = _dispatch[fext] = _compile(fext)
+    subject = basename.replace('\n', ' ') + '\n' + type_str.replace('\n', ' ')
+    match = regex.match(subject)
+    if match is None:
+        instrument.count('no rule -> unknown')
+        return UNKNOWN
+    i = int(match.lastgroup[1:])
+    if instrument.enabled:
+        instrument.count(_label(i))
+    return _codes[i]
@@ -0,0 +1,148 @@
+import atexit
+import json
+import os
+
+from album_detector import atomic_file
+
+# Written next to the music, unless a central hint database is used
+HINT_FILE = 'album-hint.json'
+
+class HintStore:
+    """ Hints of album directories. Each directory's hints are read once and
+    kept while the file they came from is unchanged (by mtime). Changes are
+    buffered until flush(), which replaces each file atomically.
+
+    With db_path, new hints go to that JSON file ({directory: hints}) rather
+    than next to the music, so read-only trees can be hinted too. Hints
+    found in a directory are still used, until the database has hints for
+    that directory. """
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        # fpath: (mtime_ns or None if missing, content)
+        self._files = {}
+        self._dirty = set()
+
+    def has(self, path, name):
+        return name in self._hints(os.path.dirname(path))
+
+    def get(self, path, name, default=None):
+        return self._hints(os.path.dirname(path)).get(name, default)
+
+    def set(self, path, name, value):
+        self._writable(os.path.dirname(path))[name] = value
+
+    def erase(self, path, name):
+        self._writable(os.path.dirname(path)).pop(name, None)
+
+    def flush(self):
+        """ Changes which cannot be written are dropped, the first OSError is
+        raised once every file was tried """
+        dirty, self._dirty = sorted(self._dirty), set()
+        error = None
+        for fpath in dirty:
+            try:
+                atomic_file.write_atomic(fpath, json.dumps(self._files[fpath][1]), prefix='.hint-')
+            except OSError as e:
+                del self._files[fpath] # read again when needed
+                error = error or e
+                continue
+            self._files[fpath] = (_mtime(fpath), self._files[fpath][1])
+        if error is not None:
+            raise error
+
+    def _hints(self, dirname):
+        if self.db_path is not None:
+            hints = self._load(self.db_path).get(os.path.abspath(dirname))
+            if hints is not None:
+                return hints
+        return self._load(os.path.join(dirname, HINT_FILE))
+
+    def _writable(self, dirname):
+        if self.db_path is None:
+            fpath = os.path.join(dirname, HINT_FILE)
+            hints = self._load(fpath)
+        else:
+            fpath = self.db_path
+            # Start from the hints found in the directory, if any
+            hints = self._load(fpath).setdefault(os.path.abspath(dirname),
+                    dict(self._load(os.path.join(dirname, HINT_FILE))))
+        self._dirty.add(fpath)
+        return hints
+
+    def _load(self, fpath):
+        cached = self._files.get(fpath)
+        if fpath in self._dirty:
+            return cached[1] # buffered changes win
+        mtime = _mtime(fpath)
+        if cached is None or cached[0] != mtime:
+            content = {}
+            if mtime is not None:
+                with open(fpath, 'r') as f:
+                    content = json.load(f)
+            cached = self._files[fpath] = (mtime, content)
+        return cached[1]
+
+def _mtime(fpath):
+    try:
+        return os.stat(fpath).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+class HintQueue:
+    """ Hints needed by albums scanned with deferred hints, one JSON line
+    {"album", "path", "name", "message", "guesses", "index"} per album. With
+    resume, items are appended to those already in the file.
+
+    index: the index file of a --mkindex scan, the albums are then added
+    to it once their hints are given, rather than exported """
+    def __init__(self, fpath, resume=False, index=None):
+        self.fpath = fpath
+        self.index = index
+        self._f = open(fpath, 'a' if resume else 'w')
+
+    def add(self, album, path, name, message, guesses=None):
+        item = {
+                'album': album,
+                'path': path,
+                'name': name,
+                'message': message,
+                'guesses': guesses or [],
+                'index': self.index,
+                }
+        self._f.write(json.dumps(item) + '\n')
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+def open_queue(fpath, resume=False, index=None):
+    queue = HintQueue(fpath, resume, index)
+    atexit.register(queue.close)
+    return queue
+
+def load_queue(fpath):
+    """ Returns the items of a HintQueue file. A line cut short is ignored. """
+    retval = []
+    with open(fpath, 'r') as f:
+        for line in f:
+            try:
+                retval.append(json.loads(line))
+            except ValueError:
+                continue
+    return retval
+
+def write_queue(fpath, items):
+    atomic_file.write_atomic(fpath, ''.join(json.dumps(item) + '\n' for item in items),
+            prefix='.hint-')
+
+_store = HintStore()
+atexit.register(lambda: _store.flush())
+
+def open_store(db_path=None):
+    global _store
+    _store.flush()
+    _store = HintStore(db_path)
+    return _store
+
+def current():
+    return _store
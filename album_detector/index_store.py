@@ -0,0 +1,139 @@
+import difflib
+import json
+import os
+import sqlite3
+
+from album_detector import knowledge
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artist (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    norm TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS album (
+    id INTEGER PRIMARY KEY,
+    artist_id INTEGER NOT NULL REFERENCES artist (id),
+    name TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS artist_norm ON artist (norm);
+CREATE INDEX IF NOT EXISTS album_norm ON album (norm);
+CREATE INDEX IF NOT EXISTS album_artist ON album (artist_id);
+"""
+
+_SELECT = """
+SELECT album.path, artist.name, album.name, album.fingerprint
+FROM album JOIN artist ON album.artist_id = artist.id
+"""
+
+def norm_artist_name(name):
+    return name.strip().casefold()
+
+def norm_album_name(name):
+    return knowledge.norm_album_name(name).casefold()
+
+def _similarity(a, b):
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+class IndexStore:
+    """ SQLite backed album index. Entries have the same shape as the JSON
+    index: {path: {'artist': ..., 'album': ..., 'fingerprint': ...}} """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(_SCHEMA)
+        self.conn.create_function('similarity', 2, _similarity, deterministic=True)
+
+    def close(self):
+        self.conn.close()
+
+    def load_entries(self):
+        return {path: _entry(artist, album, fp)
+                for path, artist, album, fp in self.conn.execute(_SELECT)}
+
+    def sync(self, indexes):
+        """ Make the store hold exactly the given entries, in one transaction """
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE keep (path TEXT PRIMARY KEY)')
+            self.conn.executemany('INSERT INTO keep VALUES (?)', ((p,) for p in indexes))
+            self.conn.execute('DELETE FROM album WHERE path NOT IN (SELECT path FROM keep)')
+            self.conn.execute('DROP TABLE keep')
+            for path, info in indexes.items():
+                self._put(path, info)
+            self.conn.execute(
+                    'DELETE FROM artist WHERE id NOT IN (SELECT artist_id FROM album)')
+
+    def import_json(self, json_path):
+        """ Merge a legacy JSON index into the store """
+        with open(json_path, 'r') as f:
+            indexes = json.load(f)
+        with self.conn:
+            for path, info in indexes.items():
+                self._put(path, info)
+        return len(indexes)
+
+    def _put(self, path, info):
+        artist = info['artist']
+        self.conn.execute('INSERT OR IGNORE INTO artist (name, norm) VALUES (?, ?)',
+                (artist, norm_artist_name(artist)))
+        artist_id = self.conn.execute('SELECT id FROM artist WHERE name = ?',
+                (artist,)).fetchone()[0]
+        self.conn.execute("""
+                INSERT INTO album (artist_id, name, norm, path, fingerprint)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    artist_id = excluded.artist_id,
+                    name = excluded.name,
+                    norm = excluded.norm,
+                    fingerprint = excluded.fingerprint
+                """, (artist_id, info['album'], norm_album_name(info['album']),
+                    path, info.get('fingerprint')))
+
+    def by_path(self, path):
+        row = self.conn.execute(_SELECT + 'WHERE album.path = ?', (path,)).fetchone()
+        return _entry(*row[1:]) if row else None
+
+    def by_artist(self, name, mode='exact'):
+        return self._query('artist.norm', norm_artist_name(name), mode)
+
+    def by_album(self, name, mode='exact'):
+        return self._query('album.norm', norm_album_name(name), mode)
+
+    def _query(self, column, norm, mode, fuzzy_cutoff=0.6, fuzzy_limit=20):
+        """ mode: 'exact', 'prefix' or 'fuzzy' """
+        if mode == 'exact':
+            rows = self.conn.execute(_SELECT + f'WHERE {column} = ?', (norm,))
+        elif mode == 'prefix':
+            # A range scan, so that the index on the column can be used
+            rows = self.conn.execute(_SELECT + f'WHERE {column} >= ? AND {column} < ?',
+                    (norm, norm + '\U0010ffff'))
+        elif mode == 'fuzzy':
+            rows = self.conn.execute(_SELECT + f"""
+                    WHERE similarity({column}, ?) >= ?
+                    ORDER BY similarity({column}, ?) DESC LIMIT ?
+                    """, (norm, fuzzy_cutoff, norm, fuzzy_limit))
+        else:
+            raise ValueError(f'Unknown query mode {mode}')
+        return {path: _entry(artist, album, fp) for path, artist, album, fp in rows}
+
+def _entry(artist, album, fingerprint):
+    entry = {'artist': artist, 'album': album}
+    if fingerprint is not None:
+        entry['fingerprint'] = fingerprint
+    return entry
+
+_SQLITE_HEADER = b'SQLite format 3\0'
+
+def is_json_index(index_path):
+    """ Existing indexes are told apart by their header, the name only
+    decides the format of new ones """
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(len(_SQLITE_HEADER))
+    except FileNotFoundError:
+        header = b''
+    if header:
+        return header != _SQLITE_HEADER
+    return os.path.splitext(index_path)[1].lower() == '.json'
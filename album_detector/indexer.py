@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+
+from album_detector import atomic_file
+from album_detector import utils
+from album_detector import index_store
+from album_detector import discovery
+
+def fingerprint(path):
+    """ Digest of the names, sizes and mtimes of everything below path.
+    Contents are not read. """
+    records = []
+    for finfo in utils.walk_files(path):
+        st = finfo._stat
+        relpath = os.path.relpath(finfo.fpath, path)
+        records.append(f'{relpath}\0{st.st_size}\0{st.st_mtime_ns}')
+    records.sort()
+    return hashlib.sha1('\n'.join(records).encode(errors='surrogateescape')).hexdigest()
+
+def load_index(index_path):
+    """ Index files are SQLite or plain JSON (see index_store.is_json_index) """
+    if not os.path.isfile(index_path):
+        return {}
+    if not index_store.is_json_index(index_path):
+        store = index_store.IndexStore(index_path)
+        try:
+            return store.load_entries()
+        finally:
+            store.close()
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+def write_index(index_path, indexes):
+    """ Replace the content of index_path atomically """
+    if not index_store.is_json_index(index_path):
+        store = index_store.IndexStore(index_path)
+        try:
+            store.sync(indexes)
+        finally:
+            store.close()
+        return
+    atomic_file.write_atomic(index_path, json.dumps(indexes), prefix='.index-')
+
+def add_entries(index_path, entries):
+    """ Add or replace the entries {path: info} of albums analysed out of
+    update_index (e.g. once their hints are given) """
+    indexes = load_index(index_path)
+    for path, info in entries.items():
+        info['fingerprint'] = fingerprint(path)
+        indexes[path] = info
+    write_index(index_path, indexes)
+
+def update_index(root, indexes, jobs=1, checkpoint=None, recursive=False):
+    """ Bring the entries of albums under root up to date. Only albums whose
+    fingerprint changed are analysed again; entries of albums that no longer
+    exist are dropped. With recursive, albums are looked for at any depth
+    below root. Returns None if interrupted. """
+    root = os.path.normpath(root)
+    if recursive:
+        album_paths = list(discovery.find_albums(root, utils.max_album_files))
+        under_root = lambda path: path.startswith(os.path.join(root, ''))
+    else:
+        with os.scandir(root) as it:
+            album_paths = [e.path for e in it if e.is_dir()]
+        under_root = lambda path: os.path.dirname(path) == root
+    fingerprints = {path: fingerprint(path) for path in album_paths}
+
+    retval = {path: info for path, info in indexes.items() if not under_root(path)}
+    changed = set()
+    for path, fp in fingerprints.items():
+        old = indexes.get(path)
+        if old is not None and old.get('fingerprint') == fp:
+            retval[path] = old
+        else:
+            changed.add(path)
+    print(f'{len(changed)} of {len(fingerprints)} albums changed')
+
+    # The albums found above are scanned, rather than walking root again
+    results = utils.do_scan(root, utils.handle_index, jobs=jobs,
+            select=lambda path: path in changed, checkpoint=checkpoint,
+            albums=album_paths if recursive else None)
+    if results is None:
+        return None
+    for path, info in results.items():
+        info['fingerprint'] = fingerprints[path]
+        retval[path] = info
+    return retval
@@ -0,0 +1,203 @@
+import collections
+import contextlib
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+# Set by --profile, nothing is recorded otherwise
+enabled = False
+
+# Finished spans: dicts with name, album, ts, dur, self (ns) and bytes
+_events = []
+# Named event counts, see count()
+_counters = collections.Counter()
+_album = None
+_local = threading.local()
+_io_fd = None
+_io_pid = None
+
+def _rchar():
+    """ Bytes read by this process so far (Linux only, 0 elsewhere) """
+    global _io_fd, _io_pid
+    if _io_pid != os.getpid():
+        # A forked worker must not read the counters of its parent
+        _io_pid = os.getpid()
+        try:
+            _io_fd = os.open('/proc/self/io', os.O_RDONLY)
+        except OSError:
+            _io_fd = None
+    if _io_fd is None:
+        return 0
+    stats = os.pread(_io_fd, 4096, 0)
+    return int(stats[len(b'rchar: '):stats.index(b'\n')])
+
+class _Span:
+    __slots__ = ('name', 'start', 'rchar', 'child')
+
+    def __init__(self, name):
+        self.name = name
+        self.child = 0
+        self.rchar = _rchar()
+        self.start = time.monotonic_ns()
+
+@contextlib.contextmanager
+def span(name, flat=False):
+    """ Time the enclosed block. Time spent in nested spans is excluded from
+    the self time of the enclosing one. flat spans are not nested, use them
+    in coroutines, which interleave. """
+    if not enabled:
+        yield
+        return
+    sp = _Span(name)
+    stack = None if flat else _stack()
+    if stack is not None:
+        stack.append(sp)
+    try:
+        yield
+    finally:
+        dur = time.monotonic_ns() - sp.start
+        if stack is not None:
+            stack.pop()
+            if stack:
+                stack[-1].child += dur
+        _events.append({
+            'name': sp.name,
+            'album': _album,
+            'ts': sp.start,
+            'dur': dur,
+            'self': dur - sp.child,
+            'bytes': _rchar() - sp.rchar,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            })
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] += n
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def timed(name):
+    """ Decorator recording a span per call """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name, flat=True):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not enabled:
+                    return func(*args, **kwargs)
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_class(cls):
+    """ Record a span each time a cached property of cls is computed. That
+    is any descriptor calling its func attribute, like cached_property. """
+    for attr, value in vars(cls).items():
+        if inspect.isfunction(getattr(value, 'func', None)):
+            value.func = timed(f'{cls.__name__}.{attr}')(value.func)
+    return cls
+
+def per_album(func):
+    """ Decorator for functions taking an album path as first argument, spans
+    recorded during the call are attributed to that album """
+    @functools.wraps(func)
+    def wrapper(path, *args, **kwargs):
+        global _album
+        prev, _album = _album, path
+        try:
+            return func(path, *args, **kwargs)
+        finally:
+            _album = prev
+    return wrapper
+
+def collect(func, *args):
+    """ Call func in a worker process. Returns (result, spans and counts
+    recorded meanwhile) for merge(); an exception carries them along. """
+    global _counters
+    n = len(_events)
+    outer_counters, _counters = _counters, collections.Counter()
+    try:
+        result = func(*args)
+    except BaseException as e:
+        e.instrument_record = (_events[n:], _counters)
+        raise
+    else:
+        return result, (_events[n:], _counters)
+    finally:
+        del _events[n:]
+        _counters = outer_counters
+
+def merge(collected):
+    result, record = collected
+    _merge_record(record)
+    return result
+
+def merge_exception(e):
+    _merge_record(getattr(e, 'instrument_record', ([], {})))
+
+def _merge_record(record):
+    events, counters = record
+    _events.extend(events)
+    _counters.update(counters)
+
+def summary(by_album=False):
+    """ Returns {(album or None, name): {'calls', 'total', 'self', 'bytes'}} """
+    retval = {}
+    for e in _events:
+        key = (e['album'] if by_album else None, e['name'])
+        stat = retval.setdefault(key, {'calls': 0, 'total': 0, 'self': 0, 'bytes': 0})
+        stat['calls'] += 1
+        stat['total'] += e['dur']
+        stat['self'] += e['self']
+        stat['bytes'] += e['bytes']
+    return retval
+
+def print_summary(file=sys.stderr):
+    stats = sorted(summary().items(), key=lambda kv: kv[1]['self'], reverse=True)
+    print(f'{"stage":<32} {"calls":>8} {"total s":>10} {"self s":>10} {"MiB read":>10}', file=file)
+    for (_, name), stat in stats:
+        print(f'{name:<32} {stat["calls"]:>8} {stat["total"] / 1e9:>10.3f} '
+                f'{stat["self"] / 1e9:>10.3f} {stat["bytes"] / 2**20:>10.2f}', file=file)
+    if _counters:
+        print(f'{"count":>8} event', file=file)
+        for name, n in _counters.most_common():
+            print(f'{n:>8} {name}', file=file)
+
+def dump(fpath, fmt='json'):
+    """ fmt: 'json' for totals per run and per album, 'chrome' for the
+    trace event format (chrome://tracing, Perfetto) """
+    if fmt == 'chrome':
+        doc = {'traceEvents': [{
+            'name': e['name'],
+            'cat': 'album_detector',
+            'ph': 'X',
+            'ts': e['ts'] / 1000,
+            'dur': e['dur'] / 1000,
+            'pid': e['pid'],
+            'tid': e['tid'],
+            'args': {'album': e['album'], 'bytes': e['bytes']},
+            } for e in _events]}
+    else:
+        albums = {}
+        for (album, name), stat in summary(by_album=True).items():
+            albums.setdefault(album or '', {})[name] = stat
+        doc = {
+                'run': {name: stat for (_, name), stat in summary().items()},
+                'albums': albums,
+                'counters': dict(_counters),
+                }
+    with open(fpath, 'w') as f:
+        json.dump(doc, f, indent=2)
@@ -0,0 +1,149 @@
+import codecs
+import os
+import re
+import stat
+import struct
+
+# Enough to cover every signature below (ID3 headers are followed separately)
+_HEAD_SIZE = 4096
+
+_ID3_HEADER = struct.Struct('>3sBBBI')
+
+_ASF_GUID = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+_JP2_SIGNATURE = bytes.fromhex('0000000c6a5020200d0a870a')
+
+_MP4_BRANDS = {
+        b'M4A ': 'ISO Media, Apple iTunes ALAC/AAC-LC (.M4A) Audio',
+        b'M4B ': 'ISO Media, Apple iTunes ALAC/AAC-LC (.M4B) Audio Book',
+        b'M4P ': 'ISO Media, Apple iTunes AAC-LC (.M4P) Audio',
+        b'qt  ': 'ISO Media, Apple QuickTime movie',
+        b'isom': 'ISO Media, MP4 Base Media v1 [ISO 14496-12:2003]',
+        b'mp41': 'ISO Media, MP4 v1 [ISO 14496-1:ch13]',
+        b'mp42': 'ISO Media, MP4 v2 [ISO 14496-14]',
+        }
+
+_BMP_DIB_SIZES = (12, 40, 52, 56, 64, 108, 124)
+
+_MPEG_VERSIONS = {0: 'v2.5', 2: 'v2', 3: 'v1'}
+
+# Byte classes used by file(1) to tell text apart from data
+_ASCII_TEXT = set(b'\a\b\t\n\v\f\r\x1b') | set(range(0x20, 0x7f))
+_LATIN1_TEXT = _ASCII_TEXT | set(range(0xa0, 0x100))
+_EXTENDED_TEXT = _LATIN1_TEXT | set(range(0x80, 0xa0))
+
+_HTML_RE = re.compile(rb'\s*<(!doctype\s+html|html|head|body)[\s>]', re.IGNORECASE)
+_AUTORUN_RE = re.compile(rb'\s*\[autorun\]', re.IGNORECASE)
+
+def classify(fpath):
+    """ Return a `file -b` compatible description of fpath, or None if the
+    header is not recognised and the caller should ask file(1) instead. """
+    try:
+        st = os.stat(fpath)
+        if stat.S_ISDIR(st.st_mode):
+            return 'directory'
+        if not stat.S_ISREG(st.st_mode):
+            return None # FIFOs would block, devices and sockets are left to file(1)
+        with open(fpath, 'rb') as f:
+            head = f.read(_HEAD_SIZE)
+            if head.startswith(b'ID3'):
+                return _classify_id3(f, head)
+    except OSError:
+        return None
+    return classify_bytes(head)
+
+def classify_bytes(head):
+    if not head:
+        return 'empty'
+    return _classify_binary(head) or _classify_text(head)
+
+def _classify_id3(f, head):
+    if len(head) < _ID3_HEADER.size:
+        return None
+    _, major, minor, flags, size = _ID3_HEADER.unpack_from(head)
+    # Tag size is a 28-bit syncsafe integer
+    size = (size & 0x7f) | (size & 0x7f00) >> 1 | (size & 0x7f0000) >> 2 | (size & 0x7f000000) >> 3
+    retval = f'Audio file with ID3 version 2.{major}.{minor}'
+    f.seek(_ID3_HEADER.size + size + (10 if flags & 0x10 else 0))
+    contained = _classify_binary(f.read(64))
+    if contained:
+        retval += f', contains: {contained}'
+    return retval
+
+def _classify_binary(head):
+    if head.startswith(b'fLaC'):
+        return 'FLAC audio bitstream data'
+    if head.startswith(b'MAC ') and len(head) >= 6:
+        version = struct.unpack_from('<H', head, 4)[0]
+        return f"Monkey's Audio compressed format version {version}"
+    if head.startswith(b'TTA1'):
+        return 'True Audio Lossless Audio'
+    if head.startswith(b'tBaK'):
+        # file(1) has no TAK signature
+        return 'data'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'RIFF (little-endian) data, WAVE audio'
+    if head.startswith(b'OggS') and head[29:35] == b'vorbis':
+        return 'Ogg data, Vorbis audio'
+    if head[4:8] == b'ftyp' and head[8:12] in _MP4_BRANDS:
+        return _MP4_BRANDS[head[8:12]]
+    if head.startswith(_ASF_GUID):
+        return 'Microsoft ASF'
+    if len(head) >= 3 and head[0] == 0xff and head[1] & 0xe0 == 0xe0:
+        version = (head[1] >> 3) & 0x3
+        layer = (head[1] >> 1) & 0x3
+        if layer == 1 and version in _MPEG_VERSIONS:
+            return f'MPEG ADTS, layer III, {_MPEG_VERSIONS[version]}'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG image data'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG image data'
+    if head.startswith(b'II*\x00'):
+        return 'TIFF image data, little-endian'
+    if head.startswith(b'MM\x00*'):
+        return 'TIFF image data, big-endian'
+    if head.startswith(_JP2_SIGNATURE):
+        return 'JPEG 2000 image data, JP2'
+    if head.startswith(b'BM') and len(head) >= 18:
+        if struct.unpack_from('<I', head, 14)[0] in _BMP_DIB_SIZES:
+            return 'PC bitmap'
+    if head.startswith(b'%PDF-'):
+        return f'PDF document, version {head[5:8].decode(errors="ignore")}'
+    if head.startswith(b'\x00\x05\x16\x07'):
+        return 'AppleDouble encoded Macintosh file'
+    if head.startswith(b'\x00\x00\x00\x01Bud1'):
+        return 'Apple Desktop Services Store'
+    if head.startswith(b'\x00\x00\x01\xba'):
+        return 'MPEG sequence, v2, program multiplex'
+    if head.startswith(b'\x00\x00\x01\xb3'):
+        return 'MPEG sequence'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'Matroska data'
+    return None
+
+def _classify_text(head):
+    if head.startswith(b'\xff\xfe') or head.startswith(b'\xfe\xff'):
+        endian = 'little' if head.startswith(b'\xff\xfe') else 'big'
+        return f'Unicode text, UTF-16, {endian}-endian text'
+    if _HTML_RE.match(head):
+        return 'HTML document, ASCII text'
+    if _AUTORUN_RE.match(head):
+        return 'Microsoft Windows Autorun file'
+    chars = set(head)
+    if chars <= _ASCII_TEXT:
+        return 'ASCII text'
+    bom = head.startswith(b'\xef\xbb\xbf')
+    if _is_utf8(head[3:] if bom else head):
+        return 'Unicode text, UTF-8 (with BOM) text' if bom else 'Unicode text, UTF-8 text'
+    if chars <= _LATIN1_TEXT:
+        return 'ISO-8859 text'
+    if chars <= _EXTENDED_TEXT:
+        return 'Non-ISO extended-ASCII text'
+    return None
+
+def _is_utf8(data):
+    # The head may end in the middle of a multi-byte sequence
+    try:
+        text = codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+    except UnicodeDecodeError:
+        return False
+    return all(ord(c) >= 0x80 or ord(c) in _ASCII_TEXT for c in text)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+from album_detector import atomic_file
+from album_detector.operations import Operation, Mkdir
+
+# Written into every album directory exported incrementally
+MANIFEST_NAME = '.album_detector.json'
+
+def checksum(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _input_stats(op):
+    return {path: _stat_key(path) for path in op.inputs}
+
+def load_manifest(album_dir):
+    """ Returns {operation: record} of the last export of album_dir. A record
+    holds the (size, mtime) of the inputs and the (size, mtime, sha1) of the
+    outputs of the operation. """
+    try:
+        with open(os.path.join(album_dir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)['ops']
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+
+def outdated(ops, album_dir):
+    """ The operations of ops which have to run again: their command or
+    inputs changed since the last export, or their outputs do not match """
+    records = load_manifest(album_dir)
+    return [op for op in ops if not _up_to_date(op, records.get(str(op)))]
+
+def _up_to_date(op, record):
+    if isinstance(op, Mkdir):
+        return os.path.isdir(op.path)
+    if record is None:
+        return False
+    try:
+        if _input_stats(op) != record['inputs']:
+            return False
+        return all(_output_matches(path, record['outputs'].get(path)) for path in op.outputs)
+    except OSError:
+        return False
+
+def _output_matches(path, record):
+    if record is None:
+        return False
+    if _stat_key(path) == record['stat']:
+        return True
+    # Touched or copied around, only the content matters
+    return checksum(path) == record['sha1']
+
+class WriteManifest(Operation):
+    """ Record ops as exported. It depends on every output, so it is skipped
+    when any operation of the export fails. """
+    def __init__(self, album_dir, ops):
+        self.path = os.path.join(album_dir, MANIFEST_NAME)
+        self.album_dir = album_dir
+        self.ops = [op for op in ops if op.outputs and not isinstance(op, Mkdir)]
+        self.inputs = tuple(path for op in self.ops for path in op.outputs)
+        self.outputs = (self.path,)
+
+    def __str__(self):
+        return f'# write manifest "{self.path}"'
+
+    def run(self):
+        old = load_manifest(self.album_dir)
+        records = {}
+        for op in self.ops:
+            old_outputs = old.get(str(op), {}).get('outputs', {})
+            outputs = {}
+            for path in op.outputs:
+                stat = _stat_key(path)
+                prev = old_outputs.get(path)
+                if prev is not None and prev['stat'] == stat:
+                    sha1 = prev['sha1'] # do not read unchanged outputs again
+                else:
+                    sha1 = checksum(path)
+                outputs[path] = {'stat': stat, 'sha1': sha1}
+            records[str(op)] = {'inputs': _input_stats(op), 'outputs': outputs}
+
+        atomic_file.write_atomic(self.path, json.dumps({'ops': records}), prefix='.manifest-')
@@ -0,0 +1,211 @@
+import errno
+import os
+import subprocess
+
+try:
+    import fcntl
+except ImportError: # not on Windows
+    fcntl = None
+
+# ioctl of Linux for sharing extents between files (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+FILE_MODE = 0o644
+DIR_MODE = 0o755
+
+# How Copy puts a file into the library
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+
+class Operation:
+    """ A step of an export. str() gives the equivalent shell command, which
+    is what a dry run prints. """
+    # Paths read and written by the operation, the executor orders
+    # operations with them
+    inputs = ()
+    outputs = ()
+
+    def __repr__(self):
+        return str(self)
+
+    def run(self):
+        raise NotImplementedError()
+
+class Mkdir(Operation):
+    def __init__(self, path):
+        self.path = path
+        self.outputs = (path,)
+
+    def __str__(self):
+        return f'mkdir -p "{self.path}"'
+
+    def run(self):
+        os.makedirs(self.path, mode=DIR_MODE, exist_ok=True)
+
+class Copy(Operation):
+    """ Put src at dst according to mode (see LINK_MODES). Hardlinks and
+    reflinks fall back to a copy when src and dst are on different
+    filesystems. Linked files keep the permissions of src. """
+    def __init__(self, src, dst, mode='copy'):
+        assert mode in LINK_MODES, f'Unknown link mode {mode}'
+        self.src = src
+        self.dst = dst
+        self.mode = mode
+        self.inputs = (src,)
+        self.outputs = (dst,)
+
+    def __str__(self):
+        if self.mode == 'hardlink':
+            return f'ln -f "{self.src}" "{self.dst}"'
+        elif self.mode == 'reflink':
+            return f'cp --reflink=always "{self.src}" "{self.dst}"'
+        elif self.mode == 'symlink':
+            return f'ln -sf "{os.path.abspath(self.src)}" "{self.dst}"'
+        return f'cp "{self.src}" "{self.dst}"'
+
+    def run(self):
+        # Never write through a link left by an earlier export, that would
+        # modify the source
+        try:
+            os.unlink(self.dst)
+        except FileNotFoundError:
+            pass
+        try:
+            if self.mode == 'hardlink':
+                os.link(self.src, self.dst)
+                return
+            elif self.mode == 'reflink':
+                copy_file(self.src, self.dst, reflink_only=True)
+                return
+            elif self.mode == 'symlink':
+                os.symlink(os.path.abspath(self.src), self.dst)
+                return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        copy_file(self.src, self.dst)
+
+class Transcode(Operation):
+    """ Cut tracks out of source with a single ffmpeg run.
+    tracks: list of (start, duration, metadata, output path); start and
+    duration are in CD frames (1/75 sec), duration may be None. """
+    def __init__(self, source, tracks):
+        self.source = source
+        self.tracks = tracks
+        self.inputs = (source,)
+        self.outputs = tuple(t[3] for t in tracks)
+
+    def __str__(self):
+        # -y: outputs of an earlier export are overwritten
+        cmd = 'ffmpeg -y'
+        cmd += ' -i "%s"' % self.source
+        for start, duration, metadata, out_fname in self.tracks:
+            # Options placed after -i apply to the output, so seeking is done
+            # by decoding and is sample accurate
+            cmd += ' -ss %s' % _timestamp(start)
+            cmd += ' -compression_level 12'
+            if duration is not None:
+                cmd += ' -t %s' % _timestamp(duration)
+            cmd += ' ' + ' '.join('-metadata %s="%s"' % (k, v) for (k, v) in metadata.items())
+            cmd += f' "{out_fname}"'
+        return cmd
+
+    def argv(self):
+        argv = ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', self.source]
+        for start, duration, metadata, out_fname in self.tracks:
+            argv += ['-ss', _timestamp(start), '-compression_level', '12']
+            if duration is not None:
+                argv += ['-t', _timestamp(duration)]
+            for k, v in metadata.items():
+                argv += ['-metadata', f'{k}={v}']
+            argv.append(out_fname)
+        return argv
+
+    def run(self):
+        # Outputs left by an earlier export are outdated. Some ffmpeg
+        # versions exit with 0 without writing when an output exists.
+        for path in self.outputs:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        proc = subprocess.run(self.argv())
+        if proc.returncode != 0:
+            raise RuntimeError(f'ffmpeg exited with {proc.returncode}')
+
+class Chmod(Operation):
+    def __init__(self, paths, mode=FILE_MODE):
+        self.paths = list(paths)
+        self.mode = mode
+        self.inputs = tuple(self.paths)
+
+    def __str__(self):
+        paths = ' '.join(f'"{p}"' for p in self.paths)
+        return f'chmod {self.mode:04o} {paths}'
+
+    def run(self):
+        for path in self.paths:
+            os.chmod(path, self.mode)
+
+def _timestamp(frames):
+    return '%.2d:%.2d:%07.4f' % (frames / 60 / 60 / 75, frames / 60 / 75 % 60, frames / 75 % 60)
+
+def copy_file(src, dst, mode=FILE_MODE, reflink_only=False):
+    """ Copy in the kernel: share extents if the filesystem can, otherwise
+    copy_file_range/sendfile. dst gets mode when it is created. With
+    reflink_only, failing to share extents is an error. """
+    with open(src, 'rb') as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            os.fchmod(fd, mode) # not subject to umask
+            if not _reflink(fsrc.fileno(), fd, reflink_only):
+                _copy_range(fsrc.fileno(), fd, os.fstat(fsrc.fileno()).st_size)
+        except OSError:
+            os.unlink(dst) # no partial copies
+            raise
+        finally:
+            os.close(fd)
+
+def _reflink(src_fd, dst_fd, required=False):
+    if fcntl is None:
+        if required:
+            raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported')
+        return False
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+        return True
+    except OSError:
+        if required:
+            raise
+        return False
+
+def _copy_range(src_fd, dst_fd, size):
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+                if n == 0:
+                    break
+                offset += n
+            return
+        except OSError:
+            pass # e.g. across filesystems on older kernels
+    # sendfile writes at the current position of dst
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    if hasattr(os, 'sendfile'):
+        try:
+            while offset < size:
+                n = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if n == 0:
+                    break
+                offset += n
+            return
+        except OSError:
+            pass
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while True:
+        buf = os.read(src_fd, 1024 * 1024)
+        if not buf:
+            break
+        os.write(dst_fd, buf)
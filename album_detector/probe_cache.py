@@ -0,0 +1,151 @@
+import atexit
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Number of writes buffered before committing
+_COMMIT_INTERVAL = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probe (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS probe_atime ON probe (atime);
+"""
+
+MISS = object()
+
+class ProbeCache:
+    """ Persistent store of per-file probe results. An entry is only valid
+    while the (size, mtime, inode) of its path is unchanged. """
+    def __init__(self, db_path, max_bytes=DEFAULT_MAX_BYTES, commit_interval=_COMMIT_INTERVAL):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.commit_interval = commit_interval
+        self._pid = None
+        self._conn = None
+
+    @property
+    def conn(self):
+        # SQLite connections must not be shared with forked workers
+        if self._pid != os.getpid():
+            dirname = os.path.dirname(self.db_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            # Let concurrent scan workers read while one of them writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+            self._pid = os.getpid()
+            self._pending = 0
+            self._total_bytes = self._conn.execute(
+                    'SELECT COALESCE(SUM(nbytes), 0) FROM probe').fetchone()[0]
+        return self._conn
+
+    def __getstate__(self):
+        return {
+                'db_path': self.db_path,
+                'max_bytes': self.max_bytes,
+                'commit_interval': self.commit_interval,
+                }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, fpath, stat, name):
+        row = self.conn.execute(
+                'SELECT size, mtime, inode, value FROM probe WHERE path = ? AND name = ?',
+                (fpath, name)).fetchone()
+        if row is None or tuple(row[:3]) != _identity(stat):
+            return MISS
+        self.conn.execute('UPDATE probe SET atime = ? WHERE path = ? AND name = ?',
+                (time.time(), fpath, name))
+        self._wrote()
+        return json.loads(row[3])
+
+    def put(self, fpath, stat, name, value):
+        value = json.dumps(value)
+        old = self.conn.execute('SELECT nbytes FROM probe WHERE path = ? AND name = ?',
+                (fpath, name)).fetchone()
+        if old:
+            self._total_bytes -= old[0]
+        nbytes = len(fpath) + len(name) + len(value)
+        self.conn.execute('INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (fpath, name, *_identity(stat), value, nbytes, time.time()))
+        self._total_bytes += nbytes
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+        self._wrote()
+
+    def invalidate(self, path=None):
+        """ Drop every entry, or only those at or below path. Returns the
+        number of entries removed. """
+        if path is None:
+            cur = self.conn.execute('DELETE FROM probe')
+        else:
+            path = os.path.normpath(path)
+            prefix = path.rstrip(os.sep) + os.sep
+            cur = self.conn.execute(
+                    'DELETE FROM probe WHERE path = ? OR substr(path, 1, ?) = ?',
+                    (path, len(prefix), prefix))
+        self.conn.commit()
+        self._total_bytes = self.conn.execute(
+                'SELECT COALESCE(SUM(nbytes), 0) FROM probe').fetchone()[0]
+        return cur.rowcount
+
+    def flush(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def _wrote(self):
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self.flush()
+
+    def _evict(self):
+        # Least recently used entries go first, down to 90% of the budget
+        target = self.max_bytes * 9 // 10
+        rows = self.conn.execute('SELECT rowid, nbytes FROM probe ORDER BY atime')
+        victims = []
+        for rowid, nbytes in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append((rowid,))
+            self._total_bytes -= nbytes
+        self.conn.executemany('DELETE FROM probe WHERE rowid = ?', victims)
+
+def _identity(stat):
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+_cache = None
+
+def open_cache(db_path, max_bytes=DEFAULT_MAX_BYTES, commit_interval=_COMMIT_INTERVAL):
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ProbeCache(db_path, max_bytes, commit_interval)
+    atexit.register(_cache.close)
+    return _cache
+
+def current():
+    return _cache
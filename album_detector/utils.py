@@ -1,8 +1,12 @@
 import os
 import sys
+import asyncio
 import subprocess
+import weakref
 import signal
-import json
+import itertools
+import collections
+from concurrent import futures
 
 # For entering hints interactively
 import inquirer
@@ -15,8 +19,28 @@ from album_detector import file_info
 from album_detector import album_info
 from album_detector import knowledge
 from album_detector import export
+from album_detector import probe_cache
+from album_detector import instrument
+from album_detector import ftype_rules
+from album_detector import hint_store
+from album_detector import discovery
 
 no_interact = False
+# Raise HintRequired instead of prompting (used by scan workers)
+defer_hints = False
+# Optional hint_store.HintQueue: albums needing a hint are recorded to it by
+# do_scan and skipped, see resolve_hints()
+hint_queue = None
+# Largest number of files (and directories) an album may have
+max_album_files = 200
+
+class HintRequired(Exception):
+    def __init__(self, path, name, message, guesses=None):
+        super().__init__(path, name, message)
+        self.path = path
+        self.name = name
+        self.message = message
+        self.guesses = guesses
 
 def smart_read(filename, encoding='utf-8', robust=False):
     try:
@@ -32,48 +56,35 @@ def smart_read(filename, encoding='utf-8', robust=False):
         else:
             raise
 
-_HINT_FILE = 'album-hint.json'
-
 def has_hint(path, name):
-    hint_file = os.path.join(os.path.dirname(path), _HINT_FILE)
-    if os.path.isfile(hint_file):
-        with open(hint_file, 'r') as f:
-            hints = json.load(f)
-            return name in hints
-    return False
+    return hint_store.current().has(path, name)
 
 def erase_hint(path, name):
-    hint_file = os.path.join(os.path.dirname(path), _HINT_FILE)
-    if os.path.isfile(hint_file):
-        with open(hint_file, 'r') as f:
-            hints = json.load(f)
-            del hints[name]
-        with open(hint_file, 'w') as f:
-            f.write(json.dumps(hints))
+    hint_store.current().erase(path, name)
 
 def get_hint(path, name, message=None, guess=None, find_common=False):
-    hint_file = os.path.join(os.path.dirname(path), _HINT_FILE)
-    hints = {}
-    if os.path.isfile(hint_file):
-        with open(hint_file, 'r') as f:
-            hints = json.load(f)
-    if name not in hints:
+    store = hint_store.current()
+    if not store.has(path, name):
         if not message:
             raise RuntimeError("Prompt message not specified")
-        hints[name] = _get_new_hint(name, message, guess, find_common)
-        with open(hint_file, 'w') as f:
-            f.write(json.dumps(hints))
-    return hints[name]
+        if defer_hints:
+            raise HintRequired(path, name, message, _hint_choices(guess, find_common))
+        store.set(path, name, _get_new_hint(name, message, guess, find_common))
+    return store.get(path, name)
+
+def _hint_choices(guess, find_common=False):
+    guess = list(guess or [])
+    if find_common and guess:
+        common_str = os.path.commonprefix(guess).strip()
+        if common_str and common_str not in guess:
+            guess.append(common_str)
+    return guess
 
 def _get_new_hint(name, message, guess=None, find_common=False):
     assert not no_interact
     MANUALLY_ENTER = '<Manually enter>'
+    guess = _hint_choices(guess, find_common)
     if guess:
-        guess = list(guess)
-        if find_common:
-            common_str = os.path.commonprefix(guess).strip()
-            if common_str and common_str not in guess:
-                guess.append(common_str)
         questions = [
             inquirer.List(
                 name,
@@ -103,16 +114,39 @@ def confirm(message):
     answers = inquirer.prompt(questions)
     return answers['confirmed']
 
+# Results of detect_encoding, keyed by file identity
+_detected_encodings = {}
+
+@instrument.timed('detect_encoding')
 def detect_encoding(fpath):
+    st = os.stat(fpath)
+    key = (os.path.abspath(fpath), st.st_size, st.st_mtime_ns, st.st_ino)
+    if key not in _detected_encodings:
+        _detected_encodings[key] = _detect_encoding(fpath)
+    return _detected_encodings[key]
+
+def _chardet_detect(data, chunk_size=4096):
+    # Feed growing prefixes until chardet is sure, the whole buffer at most
+    detector = chardet.UniversalDetector()
+    offset = 0
+    while offset < len(data) and not detector.done:
+        detector.feed(data[offset:offset + chunk_size])
+        offset += chunk_size
+        chunk_size *= 2
+    detector.close()
+    return detector.result
+
+def _detect_encoding(fpath):
     with open(fpath, 'rb') as f:
         data = f.read()
-        icu_encoding = icu.CharsetDetector(data).detect().getName()
-        icu_confidence = icu.CharsetDetector(data).detect().getConfidence()
-        icu_language = icu.CharsetDetector(data).detect().getLanguage()
+        match = icu.CharsetDetector(data).detect()
+        icu_encoding = match.getName()
+        icu_confidence = match.getConfidence()
+        icu_language = match.getLanguage()
         if icu_confidence > 60:
             return icu_encoding, icu_confidence
         else:
-            charset = chardet.detect(data)
+            charset = _chardet_detect(data)
             chardet_encoding = charset['encoding']
             chardet_confidence = int(charset['confidence'] * 100)
             chardet_language = charset['language']
@@ -133,25 +167,99 @@ def detect_encoding(fpath):
                 return chardet_encoding, chardet_confidence
     raise RuntimeError()
 
-def shell(cmd):
-    cmd = cmd.replace('`', '\`')
-    with subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE) as p:
-        p.wait()
+def shell(cmd, timeout=None):
+    cmd = cmd.replace('`', r'\`')
+    with instrument.span(_span_name(cmd)), \
+            subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE) as p:
+        try:
+            # Drain the pipe while waiting, large outputs would block otherwise
+            stdout, _ = p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.communicate()
+            raise RuntimeError(f'Timeout of {cmd} after {timeout}s')
         ercd = p.returncode
-        stdout = p.stdout.read()
-        # Sometimes `file` command emits wierd bytes
-        retval = stdout.decode(errors='ignore').strip()
-        if ercd != 0:
-            print(retval, file=sys.stderr)
-            raise RuntimeError(f'Exit code of {cmd} is {ercd}')
+    return _shell_result(cmd, ercd, stdout)
+
+# Limit of concurrent subprocesses started by shell_async
+max_shell_jobs = os.cpu_count() or 4
+_shell_semaphores = weakref.WeakKeyDictionary()
+
+async def shell_async(cmd, timeout=None):
+    """ Same as shell(), but awaitable. At most max_shell_jobs commands run
+    at the same time. """
+    cmd = cmd.replace('`', r'\`')
+    loop = asyncio.get_running_loop()
+    semaphore = _shell_semaphores.setdefault(loop, asyncio.Semaphore(max_shell_jobs))
+    async with semaphore:
+        with instrument.span(_span_name(cmd), flat=True):
+            p = await asyncio.create_subprocess_shell(cmd, stdout=subprocess.PIPE)
+            chunks = []
+            async def drain():
+                while True:
+                    chunk = await p.stdout.read(64 * 1024)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                return await p.wait()
+            try:
+                ercd = await asyncio.wait_for(drain(), timeout)
+            except asyncio.TimeoutError:
+                p.kill()
+                await p.wait()
+                raise RuntimeError(f'Timeout of {cmd} after {timeout}s')
+    return _shell_result(cmd, ercd, b''.join(chunks))
+
+def _span_name(cmd):
+    return 'shell:' + cmd.split(' ', 1)[0]
+
+def _shell_result(cmd, ercd, stdout):
+    # Sometimes `file` command emits wierd bytes
+    retval = stdout.decode(errors='ignore').strip()
+    if ercd != 0:
+        print(retval, file=sys.stderr)
+        raise RuntimeError(f'Exit code of {cmd} is {ercd}')
     return retval
 
-def mkfilelist(path: str, max_files: int = 200):
-    files = shell(f'find "{path}" | head -n {max_files+1}').split('\n')
-    assert not len(files) > max_files, 'Too many files for an album.'
-    finfos = [file_info.FileInfo(fp) for fp in files]
+def walk_files(path: str):
+    """ Yield a FileInfo for path and everything below it, in the same
+    order as `find` lists them. Symbolic links to directories are not
+    followed. """
+    root = file_info.FileInfo(path)
+    yield root
+    if not root.is_dir:
+        return
+    # (iterator, directory, number of entries seen)
+    stack = [(os.scandir(path), root, 0)]
+    try:
+        while stack:
+            it, parent, n_entries = stack[-1]
+            entry = next(it, None)
+            if entry is None:
+                it.close()
+                stack.pop()
+                parent.is_empty_dir = n_entries == 0
+                continue
+            stack[-1] = (it, parent, n_entries + 1)
+            finfo = file_info.FileInfo(entry.path, entry)
+            yield finfo
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((os.scandir(entry.path), finfo, 0))
+    finally:
+        for it, _, _ in stack:
+            it.close()
+
+@instrument.timed('mkfilelist')
+def mkfilelist(path: str, max_files: int = None):
+    if max_files is None:
+        max_files = max_album_files
+    # Take one more than allowed to tell if there are too many
+    finfos = list(itertools.islice(walk_files(path), max_files + 1))
+    assert not len(finfos) > max_files, 'Too many files for an album.'
+    file_info.prefetch(finfos)
     return finfos
 
+@instrument.per_album
 def handle_index(path):
     path = os.path.normpath(path)
     finfos = mkfilelist(path)
@@ -161,13 +269,16 @@ def handle_index(path):
             'album': album.name,
             }
 
-def handle_path(path, output_dir, audio_only):
+@instrument.per_album
+def handle_path(path, output_dir, audio_only, link_mode='copy', incremental=False):
     path = os.path.normpath(path)
     finfos = mkfilelist(path)
     album = album_info.AlbumInfo(finfos)
-    cmds = export.export_cmds(album, output_dir, audio_only=audio_only)
+    cmds = export.export_cmds(album, output_dir, audio_only=audio_only,
+            link_mode=link_mode, incremental=incremental)
     return cmds
 
+@instrument.per_album
 def handle_path_playlist(path):
     path = os.path.normpath(path)
     finfos = mkfilelist(path)
@@ -180,28 +291,216 @@ def handle_path_playlist(path):
     else:
         return export.export_cue(album), 'cue'
 
-def do_scan(album_set, album_cb, include_failed=False, limit=None):
+def do_scan(album_set, album_cb, include_failed=False, limit=None, jobs=1, select=None,
+        checkpoint=None, recursive=False, albums=None):
+    """ select: optional callback, albums for which it returns False are skipped
+    checkpoint: optional Checkpoint, every result is recorded to it as soon
+    as it is known, and albums it already has a result for are not
+    processed again
+    recursive: look for albums at any depth (see discovery.find_albums)
+    instead of taking every subdirectory of album_set as an album
+    albums: optional list of the albums below album_set, if already found """
+    if jobs > 1:
+        return _do_scan_parallel(album_set, album_cb, include_failed, limit, jobs, select,
+                checkpoint, recursive, albums)
     retval = {}
     album_set = os.path.normpath(album_set)
-    n_total = len(os.listdir(album_set))
-    n_processing = 0
-    for d in os.listdir(album_set):
-        n_processing += 1
-        print(f'Processing {n_processing}/{n_total}...')
-        path = os.path.join(album_set, d)
-        finfo = file_info.FileInfo(path)
-        if finfo.is_file or finfo.is_empty_dir:
-            print(f'Ignoring {path}')
+    entries, n_total = _album_entries(album_set, recursive, albums)
+    for n_processing, (path, entry) in enumerate(itertools.islice(entries, limit), 1):
+        print(f'Processing {_progress(n_processing, n_total)}...')
+        if _ignored(path, entry):
             continue
+        if select is not None and not select(path):
+            continue
+        if checkpoint is not None and path in checkpoint:
+            _add_result(retval, path, checkpoint.results[path], include_failed)
+        else:
+            try:
+                result = album_cb(path)
+            except KeyboardInterrupt:
+                print('Interrupted...')
+                return None
+            except HintRequired as e:
+                # Only raised with defer_hints, which comes with a hint_queue
+                _queue_hint(path, e)
+            except:
+                print(f'Skipping {path}')
+                _add_result(retval, path, None, include_failed, checkpoint)
+            else:
+                _add_result(retval, path, result, include_failed, checkpoint)
+    return retval
+
+def _album_entries(album_set, recursive, albums=None):
+    """ Returns an iterable of (path, os.DirEntry or None) and their number,
+    None if not known in advance """
+    if albums is not None:
+        return [(path, None) for path in albums], len(albums)
+    if recursive:
+        paths = discovery.find_albums(album_set, max_album_files)
+        return ((path, None) for path in paths), None
+    with os.scandir(album_set) as it:
+        entries = [(entry.path, entry) for entry in it]
+    return entries, len(entries)
+
+def _progress(n_processing, n_total):
+    return f'{n_processing}/{n_total}' if n_total is not None else f'{n_processing}'
+
+def _ignored(path, entry):
+    if entry is None:
+        return False # found by discovery.find_albums
+    finfo = file_info.FileInfo(path, entry)
+    if finfo.is_file or finfo.is_empty_dir:
+        print(f'Ignoring {path}')
+        return True
+    return False
+
+def _add_result(retval, path, result, include_failed, checkpoint=None):
+    """ result is None for albums which failed """
+    try:
+        # The hints given for the album
+        hint_store.current().flush()
+    except OSError as e:
+        # e.g. a read-only music tree, only this album fails
+        print(f'Skipping {path}, its hints cannot be written: {e}')
+        result = None
+    if checkpoint is not None:
+        checkpoint.record(path, result)
+    if result is not None or include_failed:
+        retval[path] = result
+    else:
+        retval.pop(path, None) # placeholder of a deferred album
+
+def _queue_hint(path, e):
+    """ The album is left out of the results (and of the checkpoint), so that
+    it is scanned again once the hint is given """
+    print(f'Queued hint {e.name} for {path}')
+    hint_queue.add(path, e.path, e.name, e.message, e.guesses)
+
+def _init_scan_worker(interact, defer, cache, profile, rules, hint_db, max_files):
+    global no_interact, defer_hints, max_album_files
+    no_interact = not interact
+    defer_hints = defer
+    max_album_files = max_files
+    instrument.enabled = profile
+    ftype_rules.set_user_rules(rules)
+    hint_store.open_store(hint_db)
+    if cache is not None:
+        # Workers commit every write to keep the database lock short
+        probe_cache.open_cache(cache.db_path, cache.max_bytes, commit_interval=1)
+
+# Albums submitted to the workers ahead of the one whose result is awaited,
+# per worker
+_SCAN_AHEAD = 4
+
+def _do_scan_parallel(album_set, album_cb, include_failed, limit, jobs, select, checkpoint,
+        recursive, albums):
+    """ Same as do_scan, but albums are processed by a pool of worker
+    processes. Albums which need a hint are processed in this process once
+    the others are done, so that prompting never blocks a worker. """
+    retval = {}
+    album_set = os.path.normpath(album_set)
+    entries, n_total = _album_entries(album_set, recursive, albums)
+    deferred = []
+    cache = probe_cache.current()
+    if cache is not None:
+        cache.flush()
+    hint_store.current().flush()
+
+    def collect(n_processing, path, future):
+        print(f'Processing {_progress(n_processing, n_total)}...')
+        if future is None:
+            _add_result(retval, path, checkpoint.results[path], include_failed)
+            return
+        try:
+            result = instrument.merge(future.result())
+        except HintRequired as e:
+            instrument.merge_exception(e)
+            if hint_queue is not None:
+                _queue_hint(path, e)
+                return
+            # Keep the position in the result
+            retval[path] = None
+            deferred.append(path)
+            return
+        except Exception as e:
+            instrument.merge_exception(e)
+            print(f'Skipping {path}')
+            result = None
+        _add_result(retval, path, result, include_failed, checkpoint)
+
+    with futures.ProcessPoolExecutor(jobs, initializer=_init_scan_worker,
+            initargs=(not no_interact, defer_hints or not no_interact, cache, instrument.enabled,
+                ftype_rules.user_rules(), hint_store.current().db_path, max_album_files)) as executor:
+        # Albums are submitted as they are found and collected in order
+        pending = collections.deque()
         try:
-            retval[path] = album_cb(path)
+            for n_processing, (path, entry) in enumerate(itertools.islice(entries, limit), 1):
+                if _ignored(path, entry):
+                    continue
+                if select is not None and not select(path):
+                    continue
+                if checkpoint is not None and path in checkpoint:
+                    pending.append((n_processing, path, None))
+                else:
+                    # Spans recorded by the worker come back with the result
+                    pending.append((n_processing, path,
+                            executor.submit(instrument.collect, album_cb, path)))
+                while len(pending) > jobs * _SCAN_AHEAD:
+                    collect(*pending.popleft())
+            while pending:
+                collect(*pending.popleft())
         except KeyboardInterrupt:
-            print(f'Interrupted...')
+            print('Interrupted...')
+            executor.shutdown(wait=False, cancel_futures=True)
+            return None
+
+    for path in deferred:
+        print(f'Resolving hints for {path}')
+        try:
+            result = album_cb(path)
+        except KeyboardInterrupt:
+            print('Interrupted...')
             return None
         except:
             print(f'Skipping {path}')
-            if include_failed:
-                retval[path] = None
-        if type(limit) is int and n_processing >= limit:
+            result = None
+        _add_result(retval, path, result, include_failed, checkpoint)
+    return retval
+
+def resolve_hints(queue_path, album_cb, index_cb):
+    """ Ask for the hints of a queue written by a scan with deferred hints,
+    all of them first, then process the albums again: with
+    index_cb(album, index_path) if queued by a scan for an index, with
+    album_cb(album) otherwise. Albums which still fail stay in the queue.
+    Returns {album: result}. """
+    items = hint_store.load_queue(queue_path)
+    store = hint_store.current()
+    for n, item in enumerate(items, 1):
+        if store.has(item['path'], item['name']):
+            continue
+        print(f'Hint {n}/{len(items)} for {item["album"]}')
+        store.set(item['path'], item['name'],
+                _get_new_hint(item['name'], item['message'], item['guesses']))
+        store.flush()
+
+    retval = {}
+    remaining = []
+    for i, item in enumerate(items):
+        album = item['album']
+        print(f'Processing {album}')
+        try:
+            if item.get('index') is not None:
+                retval[album] = index_cb(album, item['index'])
+            else:
+                retval[album] = album_cb(album)
+        except KeyboardInterrupt:
+            print('Interrupted...')
+            remaining += items[i:]
             break
+        except:
+            print(f'Skipping {album}')
+            retval[album] = None
+        if not retval[album]:
+            remaining.append(item)
+    hint_store.write_queue(queue_path, remaining)
     return retval
@@ -0,0 +1,140 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from album_detector import audio_tags
+from tests.tools import mksynthlib
+
+CUESHEET = '''PERFORMER "Artist"
+TITLE "Album"
+FILE "CDImage.flac" WAVE
+  TRACK 01 AUDIO
+    TITLE "One"
+    INDEX 01 00:00:00
+'''
+
+def _id3v1(title, artist, album, track):
+    return (b'TAG' + title.encode().ljust(30, b'\x00') + artist.encode().ljust(30, b'\x00')
+            + album.encode().ljust(30, b'\x00') + b'2001' + bytes(28) + bytes([0, track, 0]))
+
+def _apev2(items):
+    data = b''
+    for key, value in items.items():
+        value = value.encode()
+        data += struct.pack('<II', len(value), 0) + key.encode() + b'\x00' + value
+    footer = struct.pack('<8sIIII8x', b'APETAGEX', 2000, len(data) + 32, len(items), 0)
+    return data + footer
+
+def _riff(info):
+    chunks = b''
+    for key, value in info.items():
+        value = value.encode() + b'\x00'
+        chunks += key + struct.pack('<I', len(value)) + value + b'\x00' * (len(value) & 1)
+    fmt = b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 2, 44100, 44100 * 4, 4, 16)
+    list_chunk = b'LIST' + struct.pack('<I', len(chunks) + 4) + b'INFO' + chunks
+    body = b'WAVE' + fmt + list_chunk + b'data' + struct.pack('<I', 0)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def _box(box_type, payload):
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+def _mp4(items):
+    ilst = b''
+    for item_type, value in items.items():
+        if item_type == b'trkn':
+            data = struct.pack('>II', 0, 0) + struct.pack('>HHHH', 0, *value, 0)
+        else:
+            data = struct.pack('>II', 1, 0) + value.encode()
+        ilst += _box(item_type, _box(b'data', data))
+    meta = _box(b'meta', bytes(4) + _box(b'ilst', ilst))
+    moov = _box(b'moov', _box(b'udta', meta))
+    return _box(b'ftyp', b'M4A \x00\x00\x00\x00') + moov + _box(b'mdat', bytes(16))
+
+class ReadTagsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def read(self, fname, data):
+        fpath = os.path.join(self.workdir, fname)
+        with open(fpath, 'wb') as f:
+            f.write(data)
+        return audio_tags.read_tags(fpath)
+
+    def samples(self):
+        return {
+                'a.flac': mksynthlib.flac_bytes({'TITLE': 'One', 'ALBUMARTIST': 'Artist',
+                    'TRACKNUMBER': '1', 'CUESHEET': CUESHEET}, 44100),
+                'a.mp3': mksynthlib.mp3_bytes({'TIT2': 'One', 'TALB': 'Album', 'TRCK': '1/2'}),
+                'a.ape': b'MAC ' + bytes(60) + _apev2({'Title': 'One', 'Cuesheet': CUESHEET}),
+                'a.wav': _riff({b'INAM': 'One', b'IART': 'Artist', b'IPRD': 'Album'}),
+                'a.m4a': _mp4({b'\xa9nam': 'One', b'\xa9alb': 'Album', b'trkn': (3, 12)}),
+                }
+
+    def test_flac(self):
+        tags = self.read('a.flac', self.samples()['a.flac'])
+        self.assertEqual(tags['TITLE'], 'One')
+        self.assertEqual(tags['album_artist'], 'Artist')
+        self.assertEqual(tags['track'], '1')
+        self.assertEqual(tags['CUESHEET'], CUESHEET)
+
+    def test_flac_repeated_tag(self):
+        data = mksynthlib.flac_bytes({'ARTIST': 'A'}, 44100)
+        comment = mksynthlib.vorbis_comment({'ARTIST': 'A'})
+        # Two ARTIST comments in one block
+        comment2 = comment[:-len('ARTIST=A') - 8] + struct.pack('<I', 2) \
+                + struct.pack('<I', 8) + b'ARTIST=A' + struct.pack('<I', 8) + b'ARTIST=B'
+        data = data[:-len(comment) - 4] + bytes([0x84]) + len(comment2).to_bytes(3, 'big') + comment2
+        self.assertEqual(self.read('a.flac', data)['ARTIST'], 'A;B')
+
+    def test_id3v2(self):
+        tags = self.read('a.mp3', self.samples()['a.mp3'])
+        self.assertEqual(tags, {'title': 'One', 'album': 'Album', 'track': '1/2'})
+
+    def test_id3v1(self):
+        data = b'\xff\xfb\x90\x64' + bytes(413) + _id3v1('One', 'Artist', 'Album', 7)
+        tags = self.read('a.mp3', data)
+        self.assertEqual(tags, {'title': 'One', 'artist': 'Artist', 'album': 'Album',
+            'date': '2001', 'track': '7'})
+
+    def test_apev2(self):
+        tags = self.read('a.ape', self.samples()['a.ape'])
+        self.assertEqual(tags, {'Title': 'One', 'Cuesheet': CUESHEET})
+
+    def test_riff(self):
+        tags = self.read('a.wav', self.samples()['a.wav'])
+        self.assertEqual(tags, {'title': 'One', 'artist': 'Artist', 'album': 'Album'})
+
+    def test_mp4(self):
+        tags = self.read('a.m4a', self.samples()['a.m4a'])
+        self.assertEqual(tags, {'title': 'One', 'album': 'Album', 'track': '3/12'})
+
+    def test_mp4_without_ilst(self):
+        data = _box(b'ftyp', b'M4A \x00\x00\x00\x00') + _box(b'moov', _box(b'mvhd', bytes(100)))
+        self.assertIsNone(self.read('a.m4a', data))
+
+    def test_riff_malformed_list(self):
+        data = self.samples()['a.wav']
+        size_at = data.index(b'LIST') + 4
+        data = data[:size_at] + struct.pack('<I', 3) + data[size_at + 4:]
+        self.assertIsNone(self.read('a.wav', data))
+
+    def test_unsupported(self):
+        self.assertIsNone(self.read('a.ogg', b'OggS' + bytes(60)))
+
+    def test_truncated_id3v2_header(self):
+        self.assertIsNone(self.read('a.mp3', b'ID3\x03\x00'))
+
+    def test_truncated(self):
+        # Files cut anywhere are either read or left to ffprobe
+        for fname, data in self.samples().items():
+            for size in range(len(data)):
+                with self.subTest(fname=fname, size=size):
+                    tags = self.read(fname, data[:size])
+                    self.assertTrue(tags is None or type(tags) is dict)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+from album_detector import utils
+from album_detector import executor
+from album_detector.operations import Copy, Transcode
+from album_detector.manifest import WriteManifest
+from tests.tools import mksynthlib
+
+@unittest.skipUnless(shutil.which('ffmpeg'), 'ffmpeg is not installed')
+class IncrementalExportTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.album = os.path.join(self.workdir, 'album')
+        self.output_dir = os.path.join(self.workdir, 'library')
+        # A CUE sheet and a FLAC image, exported by one Transcode
+        mksynthlib.make_album(self.album, 'cue-utf8-bom', 0, random.Random(0))
+
+    def export(self):
+        cmds = utils.handle_path(self.album, self.output_dir, False, incremental=True)
+        self.assertEqual(executor.run_commands(cmds), [])
+        return cmds
+
+    def test_rerun_is_empty(self):
+        self.export()
+        self.assertEqual(self.export(), [])
+
+    def test_touched_source_is_transcoded_again(self):
+        outputs = [out for cmd in self.export() if isinstance(cmd, Transcode) for out in cmd.outputs]
+        self.assertTrue(outputs)
+        source = os.path.join(self.album, 'CDImage.flac')
+        mtime = time.time() + 10
+        os.utime(source, (mtime, mtime))
+        # Some ffmpeg versions exit with 0 when refusing to overwrite
+        for out in outputs:
+            os.utime(out, (0, 0))
+
+        cmds = self.export()
+        kinds = [type(cmd) for cmd in cmds]
+        self.assertIn(Transcode, kinds)
+        self.assertIn(WriteManifest, kinds)
+        for out in outputs:
+            self.assertNotEqual(os.stat(out).st_mtime, 0, f'{out} not overwritten')
+        self.assertEqual(self.export(), [])
+
+class SpecialFilesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.album = os.path.join(self.workdir, 'album')
+        mksynthlib.make_album(self.album, 'flac', 0, random.Random(0))
+
+    def test_dangling_symlink(self):
+        os.symlink(os.path.join(self.workdir, 'missing'), os.path.join(self.album, 'dangling'))
+        cmds = utils.handle_path(self.album, os.path.join(self.workdir, 'library'), False)
+        self.assertIn(Copy, [type(cmd) for cmd in cmds])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,7 +21,7 @@ class IntegrationTest(unittest.TestCase):
             print(f'Processing {n_processing}/{n_total}...')
             print(f'{path}')
             cmds = utils.handle_path(path, '/tmp', False)
-            cmds = '\n'.join(cmds)
+            cmds = '\n'.join(str(cmd) for cmd in cmds)
             try:
                 self.assertEqual(cmds, golden)
             except:
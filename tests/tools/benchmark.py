@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from album_detector import utils
+
+import mksynthlib
+
+def _reset():
+    # Keep runs independent of each other
+    utils._detected_encodings.clear()
+
+def _album_paths(root):
+    with os.scandir(root) as it:
+        return sorted(e.path for e in it if e.is_dir())
+
+def _handle_path(path):
+    return utils.handle_path(path, '/tmp', False)
+
+def _time_per_album(func, paths):
+    _reset()
+    n_failed = 0
+    start = time.perf_counter()
+    for path in paths:
+        try:
+            func(path)
+        except Exception:
+            n_failed += 1
+    sec = (time.perf_counter() - start) / len(paths)
+    if n_failed:
+        print(f'{func.__name__}: {n_failed} of {len(paths)} albums failed', file=sys.stderr)
+    return sec
+
+def _time_scan(root, n_albums, jobs):
+    _reset()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = utils.do_scan(root, utils.handle_index, jobs=jobs)
+    sec = time.perf_counter() - start
+    if len(results) != n_albums:
+        print(f'do_scan: {n_albums - len(results)} of {n_albums} albums failed', file=sys.stderr)
+    return sec
+
+def library(workdir, n_albums, seed):
+    """ Generate the library once, later runs reuse it """
+    root = os.path.join(workdir, f'synthlib-{n_albums}-{seed}')
+    if not os.path.isdir(root):
+        print(f'Generating {n_albums} albums in {root}...', file=sys.stderr)
+        tmp_root = root + '.tmp'
+        mksynthlib.make_library(tmp_root, n_albums, seed)
+        os.rename(tmp_root, root)
+    return root
+
+def run(sizes, workdir, seed, sample, jobs, repeat=1):
+    """ Returns {metric: seconds}, per album for handle_path and
+    handle_index, for the whole library for do_scan. The best of repeat
+    runs is kept. """
+    retval = {}
+    for n_albums in sizes:
+        root = library(workdir, n_albums, seed)
+        paths = _album_paths(root)[:sample]
+        for _ in range(repeat):
+            timings = {
+                    f'handle_path/{n_albums}': _time_per_album(_handle_path, paths),
+                    f'handle_index/{n_albums}': _time_per_album(utils.handle_index, paths),
+                    f'do_scan/{n_albums}': _time_scan(root, n_albums, jobs),
+                    }
+            for metric, sec in timings.items():
+                retval[metric] = min(sec, retval.get(metric, sec))
+    return retval
+
+def report(results, baseline, threshold):
+    """ Print the results next to the baseline. Returns the metrics which
+    got slower by more than threshold. """
+    regressions = []
+    print(f'{"metric":<24} {"seconds":>12} {"baseline":>12} {"change":>8}')
+    for metric, sec in results.items():
+        line = f'{metric:<24} {sec:>12.6f}'
+        if metric in baseline:
+            change = sec / baseline[metric] - 1
+            line += f' {baseline[metric]:>12.6f} {change:>+8.1%}'
+            if change > threshold:
+                line += '  REGRESSION'
+                regressions.append(metric)
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the detector over synthetic libraries')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'album-detector-bench'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample', type=int, default=100,
+            help='Number of albums timed with handle_path and handle_index')
+    parser.add_argument('--jobs', type=int, default=1, help='Workers of do_scan')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the fastest counts')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+            help='Slowdown reported as a regression (0.1 for 10%%)')
+    parser.add_argument('--output', help='Save the results, to be used as a baseline')
+    args = parser.parse_args()
+
+    # Nobody answers prompts during a benchmark
+    utils.no_interact = True
+    os.makedirs(args.workdir, exist_ok=True)
+    results = run(args.sizes, args.workdir, args.seed, args.sample, args.jobs, args.repeat)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
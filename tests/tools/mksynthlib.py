@@ -0,0 +1,181 @@
+import argparse
+import os
+import random
+import struct
+
+# Tiny but well formed files: only the headers and tags the detector reads,
+# no audio payload to speak of.
+
+SAMPLE_RATE = 44100
+
+_JPEG = (b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x48\x00\x48\x00\x00'
+        b'\xff\xd9')
+_DS_STORE = b'\x00\x00\x00\x01Bud1' + bytes(32)
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, no padding: 417 bytes per frame
+_MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(417 - 4)
+
+_JA_WORDS = ['青い', '空', 'の', '向こう', 'へ', '夢', '見る', '少女', '風', '歌', '夜明け', '約束']
+_ZH_WORDS = ['月光', '下', '的', '思念', '远方', '故乡', '春风', '花开', '永远', '爱', '时光', '回忆']
+_EN_WORDS = ['Blue', 'Sky', 'Dream', 'Night', 'Light', 'Road', 'Home', 'Rain', 'Heart', 'Song']
+
+# (kind, weight)
+ALBUM_KINDS = [
+        ('flac', 4),
+        ('mp3', 3),
+        ('cue-sjis', 1),
+        ('cue-gbk', 1),
+        ('cue-utf8-bom', 1),
+        ('embedded-cue', 1),
+        ]
+
+def vorbis_comment(tags):
+    vendor = b'reference libFLAC 1.4.3 20230623'
+    data = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(tags))
+    for key, value in tags.items():
+        comment = f'{key}={value}'.encode()
+        data += struct.pack('<I', len(comment)) + comment
+    return data
+
+def flac_bytes(tags, n_samples):
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6) # block and frame sizes
+    # sample rate (20 bits), channels - 1 (3), bits per sample - 1 (5), samples (36)
+    streaminfo += (SAMPLE_RATE << 44 | 1 << 41 | 15 << 36 | n_samples).to_bytes(8, 'big')
+    streaminfo += bytes(16) # MD5 of the audio
+    comment = vorbis_comment(tags)
+    return (b'fLaC'
+            + bytes([0]) + len(streaminfo).to_bytes(3, 'big') + streaminfo
+            + bytes([0x84]) + len(comment).to_bytes(3, 'big') + comment)
+
+def _syncsafe(n):
+    return bytes([n >> 21 & 0x7f, n >> 14 & 0x7f, n >> 7 & 0x7f, n & 0x7f])
+
+def mp3_bytes(tags, n_frames=2):
+    frames = b''
+    for frame_id, value in tags.items():
+        data = b'\x01' + value.encode('utf-16') # UTF-16 with BOM
+        frames += frame_id.encode() + struct.pack('>IH', len(data), 0) + data
+    id3 = b'ID3\x03\x00\x00' + _syncsafe(len(frames)) + frames
+    return id3 + _MP3_FRAME * n_frames
+
+def _msf(frames):
+    return '%.2d:%.2d:%.2d' % (frames // 75 // 60, frames // 75 % 60, frames % 75)
+
+def cue_text(artist, album, tracks, audio_fname, track_len):
+    lines = [
+            'REM GENRE "Soundtrack"',
+            'REM DATE 2001',
+            'REM COMMENT "ExactAudioCopy v1.6"',
+            f'PERFORMER "{artist}"',
+            f'TITLE "{album}"',
+            f'FILE "{audio_fname}" WAVE',
+            ]
+    for i, title in enumerate(tracks, 1):
+        lines += [
+                '  TRACK %.2d AUDIO' % i,
+                f'    TITLE "{title}"',
+                f'    PERFORMER "{artist}"',
+                f'    INDEX 01 {_msf((i - 1) * track_len)}',
+                ]
+    return '\r\n'.join(lines) + '\r\n'
+
+def _title(rng, words, n_words=3):
+    sep = ' ' if words is _EN_WORDS else ''
+    return sep.join(rng.choice(words) for _ in range(n_words))
+
+def _write(fpath, data):
+    with open(fpath, 'wb') as f:
+        f.write(data)
+
+def make_album(album_dir, kind, index, rng):
+    """ Create one album of the given kind in album_dir """
+    os.makedirs(album_dir)
+    artist = f'Artist {index % 97}'
+    n_tracks = rng.randint(4, 14)
+    track_len = 75 * rng.randint(120, 300) # in CD frames
+
+    if kind in ('flac', 'mp3'):
+        album = f'{_title(rng, _EN_WORDS)} {index}'
+        n_discs = 2 if rng.random() < 0.2 else 1
+        for disc in range(1, n_discs + 1):
+            disc_dir = os.path.join(album_dir, f'CD{disc}') if n_discs > 1 else album_dir
+            os.makedirs(disc_dir, exist_ok=True)
+            disc_album = f'{album} Disc {disc}' if n_discs > 1 else album
+            for t in range(1, n_tracks + 1):
+                title = _title(rng, _EN_WORDS)
+                fname = os.path.join(disc_dir, '%.2d - %s.%s' % (t, title, kind))
+                if kind == 'flac':
+                    _write(fname, flac_bytes({
+                        'ALBUM': disc_album,
+                        'ARTIST': artist,
+                        'TITLE': title,
+                        'TRACKNUMBER': f'{t}/{n_tracks}',
+                        'DATE': '2001',
+                        }, track_len * SAMPLE_RATE // 75))
+                else:
+                    _write(fname, mp3_bytes({
+                        'TALB': disc_album,
+                        'TPE1': artist,
+                        'TIT2': title,
+                        'TRCK': f'{t}/{n_tracks}',
+                        }))
+    elif kind.startswith('cue-'):
+        encoding, words = {
+                'cue-sjis': ('shift_jis', _JA_WORDS),
+                'cue-gbk': ('gbk', _ZH_WORDS),
+                'cue-utf8-bom': ('utf-8-sig', _JA_WORDS),
+                }[kind]
+        album = f'{_title(rng, words)} {index}'
+        tracks = [_title(rng, words, 4) for _ in range(n_tracks)]
+        cue = cue_text(artist, album, tracks, 'CDImage.flac', track_len)
+        _write(os.path.join(album_dir, 'CDImage.cue'), cue.encode(encoding))
+        _write(os.path.join(album_dir, 'CDImage.flac'),
+                flac_bytes({}, n_tracks * track_len * SAMPLE_RATE // 75))
+    elif kind == 'embedded-cue':
+        album = f'{_title(rng, _EN_WORDS)} {index}'
+        tracks = [_title(rng, _EN_WORDS) for _ in range(n_tracks)]
+        cue = cue_text(artist, album, tracks, 'image.flac', track_len)
+        _write(os.path.join(album_dir, 'image.flac'), flac_bytes({'CUESHEET': cue},
+                n_tracks * track_len * SAMPLE_RATE // 75))
+    else:
+        raise ValueError(f'Unknown album kind {kind}')
+
+    _write(os.path.join(album_dir, 'cover.jpg'), _JPEG)
+    if rng.random() < 0.5:
+        os.makedirs(os.path.join(album_dir, 'Scans'))
+        for i in range(rng.randint(1, 6)):
+            _write(os.path.join(album_dir, 'Scans', f'booklet{i:02d}.jpg'), _JPEG)
+    if rng.random() < 0.5:
+        _write(os.path.join(album_dir, 'rip.log'), b'Exact Audio Copy V1.6 from 23. October 2020\r\n')
+    garbage = {
+            'Thumbs.db': bytes(64),
+            '.DS_Store': _DS_STORE,
+            'autorun.inf': b'[autorun]\r\nicon=disc.ico\r\n',
+            'playlist.m3u': b'01.flac\n',
+            }
+    for fname in rng.sample(sorted(garbage), rng.randint(0, 2)):
+        _write(os.path.join(album_dir, fname), garbage[fname])
+
+def make_library(root, n_albums, seed=0):
+    """ Create n_albums albums under root (album00000, album00001, ...).
+    The same seed always gives the same library. """
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in ALBUM_KINDS]
+    weights = [weight for _, weight in ALBUM_KINDS]
+    os.makedirs(root, exist_ok=True)
+    for i in range(n_albums):
+        kind = rng.choices(kinds, weights)[0]
+        make_album(os.path.join(root, f'album{i:05d}'), kind, i, rng)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic music library')
+    parser.add_argument('output')
+    parser.add_argument('--albums', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    assert not os.path.exists(args.output), f'{args.output} exists'
+    make_library(args.output, args.albums, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from album_detector import utils
 
 def album_cb(path):
     cmds = utils.handle_path(path, '/tmp', False)
-    cmds = '\n'.join(cmds)
+    cmds = '\n'.join(str(cmd) for cmd in cmds)
     return cmds
 
 def main():
@@ -0,0 +1,146 @@
+import argparse
+import timeit
+
+from album_detector import file_info
+
+def make_cue(n_tracks):
+    lines = [
+            'REM GENRE "Anime"',
+            'REM DATE 2004',
+            'REM DISCID 12345678',
+            'REM COMMENT "ExactAudioCopy v0.99pb4"',
+            'REM REPLAYGAIN_ALBUM_GAIN -7.50 dB',
+            'REM REPLAYGAIN_ALBUM_PEAK 0.999969',
+            'CATALOG 4988001234567',
+            'PERFORMER "Various Artists"',
+            'TITLE "Compilation"',
+            'FILE "image.flac" WAVE',
+            ]
+    for i in range(1, n_tracks + 1):
+        start = 75 * 200 * i
+        lines += [
+                '  TRACK %.2d AUDIO' % i,
+                f'    TITLE "Track {i}"',
+                f'    PERFORMER "Artist {i}"',
+                '    ISRC JPABC%.7d' % i,
+                '    REM REPLAYGAIN_TRACK_GAIN -6.80 dB',
+                '    REM REPLAYGAIN_TRACK_PEAK 0.988525',
+                '    FLAGS DCP',
+                '    INDEX 00 %.2d:%.2d:%.2d' % ((start - 150) // 75 // 60, (start - 150) // 75 % 60, (start - 150) % 75),
+                '    INDEX 01 %.2d:%.2d:%.2d' % (start // 75 // 60, start // 75 % 60, start % 75),
+                ]
+    return '\r\n'.join(lines) + '\r\n'
+
+def legacy_parse_cue(cue_str):
+    """ parse_cue as of the if/elif chain implementation """
+    cue_str = cue_str.replace('\ufeff', '') # Remove BOM
+    cue_str = cue_str.replace('\r\n', '\n')
+    d = cue_str.split('\n')
+    general = {}
+    tracks = []
+    
+    for line in d:
+        if not line:
+            continue
+        elif line.startswith('REM DISCNUMBER '):
+            pass
+        elif line.startswith('REM TOTALDISCS '):
+            pass
+        elif line.startswith('REM ACCURATERIPID '):
+            pass
+        elif line.startswith('REM CATALOG '):
+            pass
+        elif line.startswith('REM GENRE '):
+            general['genre'] = ' '.join(line.split(' ')[2:])
+        elif line.startswith('REM DATE '):
+            general['date'] = ' '.join(line.split(' ')[2:])
+        elif line.startswith('REM DISCID '):
+            pass
+        elif line.startswith('REM COMMENT '):
+            pass
+        elif line.startswith('REM REPLAYGAIN_TRACK_GAIN '):
+            pass
+        elif line.startswith('REM REPLAYGAIN_ALBUM_GAIN '):
+            pass
+        elif line.startswith('REM REPLAYGAIN_ALBUM_PEAK '):
+            pass
+        elif line.startswith('REM COMPOSER '):
+            pass
+        elif line.startswith('SONGWRITER '):
+            pass
+        elif line.startswith('CATALOG '):
+            pass
+        elif line.startswith('PERFORMER '):
+            general['artist'] = ' '.join(line.split(' ')[1:]).replace('"', '')
+        elif line.startswith('TITLE '):
+            general['album'] = ' '.join(line.split(' ')[1:]).replace('"', '')
+        elif line.startswith('FILE '):
+            general['file'] = ' '.join(line.split(' ')[1:-1]).replace('"', '')
+        elif line.startswith('  TRACK '):
+            track = general.copy()
+            track['track'] = int(line.strip().split(' ')[1], 10)
+            tracks.append(track)
+        elif line.startswith('    SONGWRITER '):
+            pass
+        elif line.startswith('    ISRC '):
+            pass
+        elif line.startswith('    REM GENRE '):
+            pass
+        elif line.startswith('    REM DATE '):
+            pass
+        elif line.startswith('    REM REPLAYGAIN_TRACK_PEAK '):
+            pass
+        elif line.startswith('    REM REPLAYGAIN_TRACK_GAIN '):
+            pass
+        elif line.startswith('    REM COMPOSER '):
+            pass
+        elif line.startswith('    FLAGS PRE'):
+            pass
+        elif line.startswith('    FLAGS DCP'):
+            pass # digital copy permitted
+        elif line.startswith('    TITLE '):
+            tracks[-1]['title'] = ' '.join(line.strip().split(' ')[1:]).replace('"', '')
+        elif line.startswith('    PERFORMER '):
+            tracks[-1]['artist'] = ' '.join(line.strip().split(' ')[1:]).replace('"', '')
+        elif line.startswith('    PREGAP '):
+            # TODO: https://wiki.hydrogenaud.io/index.php?title=EAC_Gap_Settings
+            pass
+        elif line.startswith('    INDEX 00 '):
+            # TODO: https://wiki.hydrogenaud.io/index.php?title=EAC_and_Cue_Sheets
+            pass
+        elif line.startswith('    INDEX 01 '):
+            t = [int(n) for n in ' '.join(line.strip().split(' ')[2:]).replace('"', '').split(':')]
+            tracks[-1]['start'] = 75 * (60 * t[0] + t[1]) + t[2]
+            # unit of t[2] is frame (a.k.a. 1/75 sec)
+            assert t[2] < 75
+        elif line.startswith('    INDEX 02 '):
+            pass
+        elif line.startswith('    INDEX 03 '):
+            pass
+        else:
+            assert False, f'Unknown cue line: {line} (bytes: {line.encode()})'
+    
+    for i in range(len(tracks)):
+        if i != len(tracks) - 1:
+            tracks[i]['duration'] = tracks[i + 1]['start'] - tracks[i]['start']
+    
+    return general, tracks
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare parse_cue against the legacy parser')
+    parser.add_argument('--tracks', type=int, default=99)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    cue = make_cue(args.tracks)
+    _, legacy_tracks = legacy_parse_cue(cue)
+    _, tracks = file_info.parse_cue(cue)
+    for old, new in zip(legacy_tracks, tracks):
+        assert all(new[k] == v for k, v in old.items() if k != 'genre'), (old, new)
+
+    for name, parse in [('legacy', legacy_parse_cue), ('parse_cue', file_info.parse_cue)]:
+        sec = min(timeit.repeat(lambda: parse(cue), number=args.repeat, repeat=5))
+        print(f'{name:>10}: {sec / args.repeat * 1e3:.3f} ms per sheet ({args.tracks} tracks)')
+
+if __name__ == "__main__":
+    main()
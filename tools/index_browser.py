@@ -2,19 +2,49 @@ import argparse
 import os
 import json
 
+from album_detector import index_store
+
+def by_artist(indexes):
+    retval = {}
+    for path, info in indexes.items():
+        artist = info['artist']
+        retval.setdefault(artist, {})
+        retval[artist][info['album']] = path
+    return retval
+
 def main():
-    parser = argparse.ArgumentParser(description='TODO')
-    parser.add_argument('path') 
+    parser = argparse.ArgumentParser(description='Query an album index')
+    parser.add_argument('path', help='Index file (.json for the legacy format, SQLite otherwise)')
+    parser.add_argument('--artist', help='Albums of an artist')
+    parser.add_argument('--album', help='Albums by name')
+    parser.add_argument('--album-path', help='Album at a path')
+    parser.add_argument('--prefix', action='store_true', help='Match names by prefix')
+    parser.add_argument('--fuzzy', action='store_true', help='Match names approximately')
+    parser.add_argument('--import-json', metavar='JSON', help='Merge a legacy JSON index into the store')
     args = parser.parse_args()
-    with open(args.path, 'r') as f:
-        indexes = json.load(f)
-    by_path = indexes
-    by_artist = {}
-    for path, info in by_path.items():
-        artist = info['artist']
-        by_artist.setdefault(artist, {})
-        by_artist[artist][info['album']] = path
-    print(json.dumps(by_artist))
+
+    if index_store.is_json_index(args.path):
+        assert not (args.artist or args.album or args.album_path or args.import_json), \
+                'Queries need a SQLite index, try --import-json'
+        with open(args.path, 'r') as f:
+            indexes = json.load(f)
+        print(json.dumps(by_artist(indexes)))
+        return
+
+    store = index_store.IndexStore(args.path)
+    mode = 'fuzzy' if args.fuzzy else 'prefix' if args.prefix else 'exact'
+    if args.import_json:
+        n_imported = store.import_json(args.import_json)
+        print(f'Imported {n_imported} albums')
+    elif args.album_path:
+        print(json.dumps(store.by_path(os.path.normpath(args.album_path))))
+    elif args.artist:
+        print(json.dumps(by_artist(store.by_artist(args.artist, mode))))
+    elif args.album:
+        print(json.dumps(by_artist(store.by_album(args.album, mode))))
+    else:
+        print(json.dumps(by_artist(store.load_entries())))
+    store.close()
 
 if __name__ == "__main__":
     main()